@@ -0,0 +1,205 @@
+"""
+Agent name normalization: maps the free-text agent names scraped from the Idox
+details tab ("Smith Arch", "Smith Architects Ltd", "SMITH ARCHITECTS LIMITED")
+onto one row of the `agents` table, referenced by applications.agent_id.
+
+  1. Token canonicalization: lower case, punctuation dropped, common abbreviations
+     expanded, legal suffixes / filler words removed -> canonical key.
+  2. Exact match on the canonical key.
+  3. Otherwise fuzzy match (difflib ratio >= FUZZY_THRESHOLD) against the agents
+     in the same block (same first canonical token), so a typo only ever gets
+     compared with a handful of candidates, never the whole table. Names with
+     different numbers ("Studio 1" / "Studio 10") never fuzzy-match.
+  4. Otherwise a new agent.
+
+Every raw spelling seen is stored in `agent_aliases` and kept in an in-memory
+index, so repeat scrapes of a known variant resolve with one dict lookup.
+"""
+import argparse
+import re
+import threading
+from difflib import SequenceMatcher
+from datetime import datetime
+
+FUZZY_THRESHOLD = 0.92
+
+# Values the portal uses for "no agent"
+NO_AGENT = {'', '-', 'n/a', 'na', 'none', 'not applicable', 'unknown'}
+
+ABBREVIATIONS = {
+    'arch': 'architects', 'archs': 'architects', 'architect': 'architects', 'architecture': 'architects',
+    'architectural': 'architects',
+    'assoc': 'associates', 'assocs': 'associates', 'associate': 'associates',
+    'surv': 'surveyors', 'surveyor': 'surveyors', 'surveying': 'surveyors',
+    'eng': 'engineers', 'engineer': 'engineers', 'engineering': 'engineers',
+    'consultant': 'consultants', 'consultancy': 'consultants', 'consulting': 'consultants',
+    'dev': 'developments', 'development': 'developments',
+    'bldg': 'building', 'mgmt': 'management', 'svcs': 'services', 'service': 'services',
+    'plan': 'planning', 'des': 'design', 'designs': 'design',
+}
+DROPPED_TOKENS = {'ltd', 'limited', 'llp', 'plc', 'inc', 'co', 'company', 'uk', 'the', 'and'}
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+DIGITS_RE = re.compile(r'[0-9]+')
+
+def canonical_key(name):
+    """Canonical form of an agent name, or None if it means "no agent"."""
+    if name is None:
+        return None
+    text = str(name).strip().lower()
+    if text in NO_AGENT:
+        return None
+    tokens = [ABBREVIATIONS.get(t, t) for t in TOKEN_RE.findall(text.replace('&', ' and '))]
+    kept = [t for t in tokens if t not in DROPPED_TOKENS]
+    # A name made only of dropped words ("The Company Ltd") keeps them
+    return ' '.join(kept or tokens) or None
+
+def block_key(canonical):
+    return canonical.split(' ', 1)[0]
+
+class AgentIndex:
+    """
+    In-memory view of agents / agent_aliases: raw alias -> id, canonical -> id and
+    block -> [(canonical, id)]. Loaded from the DB on first use; misses fall back to
+    the DB (another process may have added the agent) before any fuzzy matching.
+    Shared by the web app's threads, hence the lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.loaded = False
+        self.aliases = {}
+        self.canonical = {}
+        self.blocks = {}
+
+    def _add_agent(self, canonical, agent_id):
+        if canonical not in self.canonical:
+            self.canonical[canonical] = agent_id
+            self.blocks.setdefault(block_key(canonical), []).append((canonical, agent_id))
+
+    def _load(self, conn):
+        if self.loaded:
+            return
+        for r in conn.execute("SELECT id, canonical FROM agents"):
+            self._add_agent(r[1], r[0])
+        self.aliases.update({r[0]: r[1] for r in conn.execute("SELECT alias, agent_id FROM agent_aliases")})
+        self.loaded = True
+
+    def _match(self, conn, canonical):
+        """Agent id for a canonical key: exact (cache, then DB), else best fuzzy match in its block."""
+        if canonical in self.canonical:
+            return self.canonical[canonical]
+        row = conn.execute("SELECT id FROM agents WHERE canonical = ?", (canonical,)).fetchone()
+        if row:
+            self._add_agent(canonical, row[0])
+            return row[0]
+        best, best_ratio = None, FUZZY_THRESHOLD
+        digits = DIGITS_RE.findall(canonical)
+        for other, agent_id in self.blocks.get(block_key(canonical), ()):
+            if DIGITS_RE.findall(other) != digits:
+                continue
+            ratio = SequenceMatcher(None, canonical, other).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = agent_id, ratio
+        return best
+
+    def lookup(self, conn, name):
+        """Agent id for a name without writing anything (works on read-only connections). None if unknown."""
+        if name in self.aliases:
+            return self.aliases[name]
+        canonical = canonical_key(name)
+        if canonical is None:
+            return None
+        with self.lock:
+            self._load(conn)
+            row = conn.execute("SELECT agent_id FROM agent_aliases WHERE alias = ?", (name,)).fetchone()
+            if row:
+                self.aliases[name] = row[0]
+                return row[0]
+            return self._match(conn, canonical)
+
+    def resolve(self, conn, name):
+        """
+        Agent id for a scraped name, creating the agent and/or alias rows when new
+        (caller commits; a caller that rolls back calls reset(), as the new ids are
+        already cached). None for empty / "no agent" values.
+        """
+        if name in self.aliases:
+            return self.aliases[name]
+        canonical = canonical_key(name)
+        if canonical is None:
+            return None
+        with self.lock:
+            self._load(conn)
+            agent_id = self._match(conn, canonical)
+            if agent_id is None:
+                conn.execute("""
+                    INSERT INTO agents (name, canonical, created_at) VALUES (?, ?, ?)
+                    ON CONFLICT(canonical) DO NOTHING
+                """, (str(name).strip(), canonical, datetime.now()))
+                agent_id = conn.execute("SELECT id FROM agents WHERE canonical = ?", (canonical,)).fetchone()[0]
+                self._add_agent(canonical, agent_id)
+            conn.execute("INSERT OR IGNORE INTO agent_aliases (alias, agent_id) VALUES (?, ?)", (name, agent_id))
+            self.aliases[name] = agent_id
+            return agent_id
+
+index = AgentIndex()
+
+def resolve(conn, name):
+    return index.resolve(conn, name)
+
+def lookup(conn, name):
+    return index.lookup(conn, name)
+
+def renormalize(conn, rebuild=False):
+    """
+    Batch (re-)normalization of existing rows: resolves every distinct agent_name
+    (once each), points applications.agent_id at the result with one set-based
+    UPDATE, and names each agent after its most common spelling.
+    rebuild=True forgets all agents / aliases first, e.g. after changing the rules above.
+    Returns counts (caller commits).
+    """
+    if rebuild:
+        conn.execute("DELETE FROM agent_aliases")
+        conn.execute("DELETE FROM agents")
+        index.reset()
+
+    names = [r[0] for r in conn.execute("SELECT DISTINCT agent_name FROM applications WHERE agent_name IS NOT NULL")]
+    for name in names:
+        resolve(conn, name)
+
+    updated = conn.execute("""
+        UPDATE applications SET agent_id = al.agent_id
+        FROM agent_aliases al
+        WHERE al.alias = applications.agent_name AND applications.agent_id IS NOT al.agent_id
+    """).rowcount
+    updated += conn.execute("""
+        UPDATE applications SET agent_id = NULL
+        WHERE agent_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM agent_aliases al WHERE al.alias = applications.agent_name)
+    """).rowcount
+
+    conn.execute("""
+        UPDATE agents SET name = (
+            SELECT agent_name FROM applications WHERE agent_id = agents.id
+            GROUP BY agent_name ORDER BY count(*) DESC, agent_name LIMIT 1
+        )
+        WHERE id IN (SELECT agent_id FROM applications WHERE agent_id IS NOT NULL)
+    """)
+    agents = conn.execute("SELECT count(*) FROM agents").fetchone()[0]
+    return {'names': len(names), 'agents': agents, 'updated': updated}
+
+if __name__ == "__main__":
+    import database
+    parser = argparse.ArgumentParser(description="Normalize agent names into the agents table.")
+    parser.add_argument('--rebuild', action='store_true', help="Forget existing agents / aliases and re-cluster from scratch")
+    args = parser.parse_args()
+    database.init_db()
+    conn = database.get_db_connection()
+    with conn:
+        result = renormalize(conn, rebuild=args.rebuild)
+        database.refresh_agent_stats(conn)
+    conn.close()
+    print(f"Normalized {result['names']} agent spellings into {result['agents']} agents "
+          f"({result['updated']} applications re-pointed).")
@@ -0,0 +1,196 @@
+"""
+Decision-time analytics: how long applications take from received (or validated) to
+decided, as distributions per decided status, agent, area and decision month.
+
+The decision moment is applications.decision_date when the portal gave one, else the
+first status_history transition into a decided status (the sync that saw the decision),
+archived history included.
+
+Three tables, all maintained incrementally (see database.init_analytics):
+  decision_facts          one row per decided application: its group keys and day counts
+  decision_day_counts     per (dimension, key, measure): how many applications took each
+                          whole number of days; updated by +/- deltas of the changed facts
+  decision_time_rollups   per (dimension, key, measure): count, mean, quartiles, p90 and a
+                          histogram over HISTOGRAM_EDGES, computed from the day counts
+Triggers on applications / status_history mark changed keyvals in analytics_dirty;
+refresh() recomputes just their facts, applies the difference to the day counts and
+re-derives the rollups of the groups whose counts moved. No step reads every fact.
+All arithmetic is vectorized pandas / NumPy.
+"""
+import argparse
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import database
+
+DIMENSIONS = ('all', 'status', 'agent', 'area', 'month')
+MEASURES = {'received': 'received_days', 'validated': 'validated_days'}
+QUANTILES = {'p25': 0.25, 'median_days': 0.5, 'p75': 0.75, 'p90': 0.9}
+HISTOGRAM_EDGES = [0, 14, 28, 56, 91, 182, 365, np.inf] # days; 56 = the 8-week statutory target
+AREA_LEVEL = 13 # areas are map grid cells (clusters.py tiles) of ~2.4 x 1.6 km at York
+DECIDED_STATUSES = database.APPROVED_STATUSES + database.REFUSED_STATUSES
+FACT_COLUMNS = ['keyval', 'status', 'agent', 'area', 'month', 'received_days', 'validated_days']
+
+def area_keys(lat, lon):
+    """Vectorized clusters.tile() at AREA_LEVEL: 'x/y' per point, None without coordinates."""
+    n = 1 << AREA_LEVEL
+    lat = np.clip(lat.astype(float), -85.0511, 85.0511)
+    x = np.floor((lon.astype(float) + 180.0) / 360.0 * n).astype('Int64').astype(str)
+    y = np.floor((1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0 * n).astype('Int64').astype(str)
+    return (x + '/' + y).where(lat.notna() & lon.notna(), None)
+
+def compute_facts(apps):
+    """Application rows (+ history decided_at) -> decision_facts rows for the decided ones."""
+    decided = pd.to_datetime(apps['decision_date'].fillna(apps['decided_at'].str[:10]), errors='coerce')
+    facts = pd.DataFrame({
+        'keyval': apps['keyval'],
+        'status': apps['status'],
+        'agent': apps['agent_id'].astype('Int64').astype(str).where(apps['agent_id'].notna(), None),
+        'area': area_keys(apps['latitude'], apps['longitude']),
+        'month': decided.dt.strftime('%Y-%m'),
+    })
+    for measure, start in (('received_days', 'received_date'), ('validated_days', 'validated_date')):
+        days = (decided - pd.to_datetime(apps[start], errors='coerce')).dt.days
+        facts[measure] = days.where(days >= 0)
+    return facts[decided.notna()]
+
+def day_count_deltas(old, new):
+    """
+    (dimension, key, measure, days, n) changes to decision_day_counts when the `old` facts
+    are replaced by the `new` ones; rows whose changes cancel out are dropped.
+    """
+    signed = pd.concat([old.assign(sign=-1), new.assign(sign=1)], ignore_index=True).assign(all='all')
+    parts = []
+    for dimension in DIMENSIONS:
+        for measure, column in MEASURES.items():
+            part = signed[[dimension, column, 'sign']].dropna()
+            parts.append(pd.DataFrame({'dimension': dimension, 'key': part[dimension], 'measure': measure,
+                                       'days': part[column].astype(int), 'n': part['sign']}))
+    deltas = pd.concat(parts).groupby(['dimension', 'key', 'measure', 'days'], as_index=False)['n'].sum()
+    return deltas[deltas['n'] != 0]
+
+def weighted_quantiles(counts, totals, q):
+    """
+    q-quantile (linear interpolation, as the pandas / NumPy default) of every group of a
+    (group, days, n) frame sorted by group then days, without expanding the counts.
+    totals: applications per group, in group order.
+    """
+    ends = counts['n'].cumsum().to_numpy() # position after each row, over all groups
+    starts = np.r_[0, np.cumsum(totals)[:-1]]
+    h = q * (totals - 1)
+    lo = np.floor(h).astype(int)
+    hi = np.minimum(lo + 1, totals - 1)
+    days = counts['days'].to_numpy()
+    v_lo = days[np.searchsorted(ends, starts + lo, side='right')]
+    v_hi = days[np.searchsorted(ends, starts + hi, side='right')]
+    return v_lo + (h - lo) * (v_hi - v_lo)
+
+def rollups(counts):
+    """decision_time_rollups rows from the day counts (dimension, key, measure, days, n) of some groups."""
+    counts = counts.sort_values(['dimension', 'key', 'measure', 'days'], ignore_index=True)
+    counts['group'] = counts.groupby(['dimension', 'key', 'measure'], sort=True).ngroup()
+    grouped = counts.assign(total=counts['days'] * counts['n']).groupby('group')
+    stats = grouped[['dimension', 'key', 'measure']].first()
+    stats['decided'] = grouped['n'].sum()
+    stats['mean_days'] = grouped['total'].sum() / stats['decided']
+    for name, q in QUANTILES.items():
+        stats[name] = weighted_quantiles(counts, stats['decided'].to_numpy(), q)
+    buckets = pd.cut(counts['days'], HISTOGRAM_EDGES, right=False, labels=False)
+    histogram = (counts.assign(bucket=buckets).groupby(['group', 'bucket'])['n'].sum()
+                 .unstack(fill_value=0).reindex(columns=range(len(HISTOGRAM_EDGES) - 1), fill_value=0))
+    stats['histogram'] = [json.dumps(h) for h in histogram.loc[stats.index].values.tolist()]
+    return [(s.dimension, s.key, s.measure, int(s.decided), round(s.mean_days, 1),
+             *(round(getattr(s, q), 1) for q in QUANTILES), s.histogram)
+            for s in stats.itertuples()]
+
+def refresh(conn):
+    """
+    Recomputes facts for the applications marked in analytics_dirty, applies the change
+    to the day counts and re-derives the rollups of every group whose counts moved
+    (caller commits). Returns the number of applications recomputed.
+    """
+    dirty = [r[0] for r in conn.execute("SELECT keyval FROM analytics_dirty")]
+    if not dirty:
+        return 0
+
+    # 1. New facts for the dirty applications (decided_at: first move into a decided status)
+    decided = ', '.join('?' * len(DECIDED_STATUSES))
+    apps = pd.read_sql_query(f"""
+        SELECT a.keyval, a.status, a.agent_id, a.received_date, a.validated_date, a.decision_date,
+               a.latitude, a.longitude,
+               (SELECT min(h.change_date) FROM {database.history_source(conn)} h
+                WHERE h.keyval = a.keyval AND h.new_status IN ({decided})) AS decided_at
+        FROM analytics_dirty d JOIN applications a ON a.keyval = d.keyval
+    """, conn, params=DECIDED_STATUSES)
+    facts = compute_facts(apps)
+    old = pd.read_sql_query(f"""
+        SELECT {', '.join(FACT_COLUMNS)} FROM decision_facts
+        WHERE keyval IN (SELECT keyval FROM analytics_dirty)
+    """, conn)
+
+    conn.execute("DELETE FROM decision_facts WHERE keyval IN (SELECT keyval FROM analytics_dirty)")
+    conn.executemany(f"""
+        INSERT INTO decision_facts ({', '.join(FACT_COLUMNS)}) VALUES ({', '.join('?' * len(FACT_COLUMNS))})
+    """, [tuple(None if pd.isna(v) else v for v in row)
+          for row in facts[FACT_COLUMNS].astype(object).itertuples(index=False, name=None)])
+
+    # 2. Day counts: old facts out, new facts in
+    deltas = day_count_deltas(old, facts)
+    conn.executemany("""
+        INSERT INTO decision_day_counts (dimension, key, measure, days, n) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (dimension, key, measure, days) DO UPDATE SET n = n + excluded.n
+    """, deltas.astype(object).itertuples(index=False, name=None))
+    conn.execute("DELETE FROM decision_day_counts WHERE n <= 0")
+
+    # 3. Rollups of the groups whose counts changed, from their day counts
+    groups = json.dumps(deltas[['dimension', 'key', 'measure']].drop_duplicates().values.tolist())
+    conn.execute("DROP TABLE IF EXISTS temp.analytics_groups")
+    conn.execute("""
+        CREATE TEMP TABLE analytics_groups AS
+        SELECT json_extract(value, '$[0]') AS dimension, json_extract(value, '$[1]') AS key,
+               json_extract(value, '$[2]') AS measure
+        FROM json_each(?)
+    """, (groups,))
+    counts = pd.read_sql_query("""
+        SELECT c.dimension, c.key, c.measure, c.days, c.n
+        FROM temp.analytics_groups g
+        JOIN decision_day_counts c ON c.dimension = g.dimension AND c.key = g.key AND c.measure = g.measure
+    """, conn)
+    conn.execute("""
+        DELETE FROM decision_time_rollups WHERE EXISTS (
+            SELECT 1 FROM temp.analytics_groups g WHERE g.dimension = decision_time_rollups.dimension
+            AND g.key = decision_time_rollups.key AND g.measure = decision_time_rollups.measure)
+    """)
+    now = datetime.now()
+    if not counts.empty:
+        conn.executemany("""
+            INSERT INTO decision_time_rollups (dimension, key, measure, decided, mean_days, p25, median_days, p75, p90,
+                                               histogram, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [row + (now,) for row in rollups(counts)])
+    conn.execute("DROP TABLE temp.analytics_groups")
+
+    conn.execute("DELETE FROM analytics_dirty")
+    return len(dirty)
+
+def rebuild(conn):
+    """Recomputes every fact, day count and rollup (caller commits)."""
+    conn.execute("DELETE FROM decision_facts")
+    conn.execute("DELETE FROM decision_day_counts")
+    conn.execute("DELETE FROM decision_time_rollups")
+    conn.execute("INSERT OR IGNORE INTO analytics_dirty (keyval) SELECT keyval FROM applications")
+    return refresh(conn)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the decision-time analytics rollups.")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute everything instead of just the changed applications")
+    args = parser.parse_args()
+    database.init_db()
+    conn = database.get_db_connection()
+    with conn:
+        count = rebuild(conn) if args.rebuild else refresh(conn)
+    conn.close()
+    print(f"Decision-time analytics refreshed for {count} applications.")
@@ -1,19 +1,44 @@
-from flask import Flask, render_template, jsonify, request
-import sqlite3
+from flask import Flask, render_template, jsonify, request, g
+import base64
+import json
 from datetime import datetime
+import agents
+import analytics
+import clusters
+import database
+import geo
+import history
 import scraper
+import scrape_queue
 import sync_manager
 import threading
 
 app = Flask(__name__)
-DB_NAME = "construction_intelligence.db"
 
-is_syncing = False
+# Shared connection pools: read-only for the GET endpoints, read/write for the rest.
+# The background sync uses its own dedicated connections (see sync_manager).
+read_pool = database.ConnectionPool(readonly=True)
+write_pool = database.ConnectionPool()
 
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+sync_lock = threading.Lock()
+
+def get_db(readonly=False):
+    """Pooled connection for the current request; returned to the pool on teardown."""
+    key = 'db_ro' if readonly else 'db_rw'
+    if key not in g:
+        setattr(g, key, (read_pool if readonly else write_pool).acquire())
+    return getattr(g, key)
+
+@app.teardown_appcontext
+def release_db(exc):
+    for key, pool in (('db_ro', read_pool), ('db_rw', write_pool)):
+        conn = g.pop(key, None)
+        if conn is not None:
+            if conn.in_transaction:
+                # Left uncommitted (the request failed): the pool rolls it back, so forget
+                # any agents the index cached from inside that transaction
+                agents.index.reset()
+            pool.release(conn)
 
 @app.route('/')
 def index():
@@ -21,19 +46,17 @@ def index():
 
 @app.route('/api/sync', methods=['POST'])
 def trigger_sync():
-    global is_syncing
-    if is_syncing:
+    # Held for the whole background run, so two clicks can't start two syncs
+    if not sync_lock.acquire(blocking=False):
         return jsonify({'status': 'running', 'message': 'Sync already in progress'})
     
     def run_sync():
-        global is_syncing
-        is_syncing = True
         try:
             sync_manager.sync_from_open_data()
         except Exception as e:
             print(f"Sync failed: {e}")
         finally:
-            is_syncing = False
+            sync_lock.release()
             
     thread = threading.Thread(target=run_sync)
     thread.daemon = True
@@ -43,60 +66,186 @@ def trigger_sync():
 
 @app.route('/api/status')
 def system_status():
-    global is_syncing
-    conn = get_db()
+    conn = get_db(readonly=True)
     last_sync = conn.execute("SELECT max(last_synced_api) FROM applications").fetchone()[0]
-    conn.close()
     return jsonify({
-        'is_syncing': is_syncing,
+        'is_syncing': sync_lock.locked(),
         'last_sync': last_sync
     })
 
 @app.route('/api/agents')
 def get_agents():
-    conn = get_db()
-    cursor = conn.cursor()
-    # Return top 50 agents by activity
-    # Exclude null or 'Independent' if you only want companies, but 'Independent' is valid filter
-    rows = cursor.execute("""
-        SELECT agent_name, count(*) as c 
-        FROM applications 
-        WHERE agent_name IS NOT NULL AND agent_name != 'Independent' 
-        GROUP BY agent_name 
-        ORDER BY c DESC 
+    conn = get_db(readonly=True)
+    # Return top 50 agents by activity, straight from the maintained agent_stats table
+    # Exclude 'Independent' if you only want companies, but 'Independent' is valid filter
+    # Names are the normalized agents' display names (agents.py)
+    rows = conn.execute("""
+        SELECT ag.name FROM agent_stats s JOIN agents ag ON ag.id = s.agent_id
+        WHERE ag.canonical != 'independent'
+        ORDER BY s.applications DESC, ag.name
         LIMIT 50
-    """ ).fetchall()
+    """).fetchall()
     
-    agents = [r['agent_name'] for r in rows]
-    conn.close()
-    return jsonify(agents)
+    return jsonify([r['name'] for r in rows])
 
-@app.route('/api/data')
-def get_data():
-    # Filters
-    # Handle both 'status' and 'status[]' conventions just in case, but standard is same key multiple times
-    statuses = request.args.getlist('status') 
-    # If no status passed, or ['ALL'], default to ALL (no filter)
-    if 'ALL' in statuses or not statuses:
-        statuses = []
-        
-    limit = request.args.get('limit', 50)
-    sort_dir = request.args.get('sort_dir', request.args.get('sort', 'desc'))
-    if sort_dir.lower() not in ['asc', 'desc']: sort_dir = 'desc'
-    
-    sort_field = request.args.get('sort_by', 'received_date')
-    valid_sorts = ['received_date', 'validated_date', 'decision_date']
-    if sort_field not in valid_sorts: sort_field = 'received_date'
-    
-    search_term = request.args.get('search', '').strip()
-    agent_filter = request.args.get('agent', '').strip()
-    start_date = request.args.get('start_date', '')
-    end_date = request.args.get('end_date', '')
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
+AGENT_STATS_SORTS = {
+    'applications': 's.applications DESC',
+    'approval_rate': 's.approved * 1.0 / s.decided DESC',
+    'fastest': 's.median_decision_days IS NULL, s.median_decision_days ASC',
+}
+
+@app.route('/api/agent-stats')
+def get_agent_stats():
+    """
+    Per-agent counts, approvals / refusals and median decision time.
+    ?sort=applications|approval_rate|fastest, ?min_decided=N (default 5) to ignore agents
+    with too few decisions for the rates to mean anything, ?limit (max 500).
+    """
+    conn = get_db(readonly=True)
+    order = AGENT_STATS_SORTS.get(request.args.get('sort', 'applications'), AGENT_STATS_SORTS['applications'])
+    min_decided = request.args.get('min_decided', 5, type=int)
+    limit = max(1, min(request.args.get('limit', 50, type=int), MAX_PAGE_SIZE))
+    rows = conn.execute(f"""
+        SELECT s.agent_id, ag.name AS agent_name, s.applications, s.approved, s.refused, s.decided,
+               s.median_decision_days
+        FROM agent_stats s JOIN agents ag ON ag.id = s.agent_id
+        WHERE ag.canonical != 'independent' AND s.decided >= ?
+        ORDER BY {order}, ag.name
+        LIMIT ?
+    """, (min_decided, limit)).fetchall()
+    return jsonify([dict(r) for r in rows])
+
+@app.route('/api/analytics')
+def get_analytics():
+    """
+    Decision-time distributions (analytics.py rollups): ?dimension=all|status|agent|area|month
+    (default status), ?measure=received|validated (interval start, default received),
+    ?min_decided=N (default 1), ?limit (max 500). Histogram counts are per `buckets` range in days.
+    """
+    conn = get_db(readonly=True)
+    dimension = request.args.get('dimension', 'status')
+    measure = request.args.get('measure', 'received')
+    if dimension not in analytics.DIMENSIONS or measure not in analytics.MEASURES:
+        return jsonify({'error': f"dimension must be one of {', '.join(analytics.DIMENSIONS)}, "
+                                 f"measure one of {', '.join(analytics.MEASURES)}"}), 400
+    min_decided = request.args.get('min_decided', 1, type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), MAX_PAGE_SIZE))
+    # Months read best in time order, everything else biggest first
+    order = "r.key DESC" if dimension == 'month' else "r.decided DESC, r.key"
+    rows = conn.execute(f"""
+        SELECT r.key, ag.name AS agent_name, r.decided, r.mean_days, r.p25, r.median_days, r.p75, r.p90,
+               r.histogram, r.updated_at
+        FROM decision_time_rollups r
+        LEFT JOIN agents ag ON r.dimension = 'agent' AND ag.id = r.key
+        WHERE r.dimension = ? AND r.measure = ? AND r.decided >= ?
+          AND ag.canonical IS NOT 'independent' -- scraper's placeholder for "no agent", as in /api/agents
+        ORDER BY {order}
+        LIMIT ?
+    """, (dimension, measure, min_decided, limit)).fetchall()
+
+    results = []
+    for r in rows:
+        item = dict(r)
+        item['histogram'] = json.loads(r['histogram'])
+        if dimension != 'agent':
+            del item['agent_name']
+        if dimension == 'area':
+            x, y = (int(v) for v in r['key'].split('/'))
+            min_lon, min_lat, max_lon, max_lat = clusters.tile_bounds(x, y, analytics.AREA_LEVEL)
+            item['bbox'] = [round(v, 6) for v in (min_lon, min_lat, max_lon, max_lat)]
+        results.append(item)
+    edges = analytics.HISTOGRAM_EDGES
+    buckets = [[lo, hi if hi != float('inf') else None] for lo, hi in zip(edges, edges[1:])]
+    return jsonify({'dimension': dimension, 'measure': measure, 'buckets': buckets, 'rows': results})
+
+@app.route('/api/clusters')
+def get_clusters():
+    """
+    Map clusters (clusters.py): per grid cell the application count, approved / refused /
+    pending split, newest received date and centroid. ?zoom=<map zoom> (or ?level=<cell
+    level> directly), ?bbox=west,south,east,north to return only the cells in view.
+    Rows are arrays in `columns` order.
+    """
+    conn = get_db(readonly=True)
+    if request.args.get('level') is not None:
+        level = request.args.get('level', type=int)
+    else:
+        zoom = request.args.get('zoom', type=int)
+        level = clusters.level_for_zoom(zoom) if zoom is not None else None
+    if level is None or not clusters.MIN_LEVEL <= level <= clusters.MAX_LEVEL:
+        return jsonify({'error': f'zoom or level ({clusters.MIN_LEVEL}-{clusters.MAX_LEVEL}) required'}), 400
+    bbox = None
+    if request.args.get('bbox'):
+        bbox = geo.parse_bbox(request.args['bbox'])
+        if not bbox:
+            return jsonify({'error': 'bbox must be west,south,east,north in degrees'}), 400
+    return jsonify({'level': level, 'columns': clusters.COLUMNS, 'cells': clusters.cells(conn, level, bbox)})
+
+# Columns the /api/data records are built from (avoid SELECT *)
+LIST_COLUMNS = [
+    'keyval', 'reference', 'status', 'proposal', 'received_date_fmt', 'validated_date_fmt', 'decision_date_fmt',
+    'address', 'agent_name', 'latitude', 'longitude', 'needs_scrape', 'portal_keyval', 'validation_warning'
+]
+PENDING_STATUSES = "('Pending', 'PCO', 'W', 'Unknown')"
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(value, keyval):
+    return base64.urlsafe_b64encode(json.dumps([value, keyval]).encode()).decode()
+
+def decode_cursor(token):
+    """Returns (sort value, keyval) of the last row of the previous page, or None if invalid."""
+    try:
+        value, keyval = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return value, str(keyval)
+    except Exception:
+        return None
+
+def _keyset_clause(sort_expr, sort_dir, after):
+    """
+    Rows strictly after `after` in ORDER BY sort_expr <dir>, keyval <dir>.
+    SQLite sorts NULLs first ascending / last descending, so NULL sort values need their own branch.
+    """
+    value, keyval = after
+    if sort_dir == 'desc':
+        if value is None:
+            return f"({sort_expr} IS NULL AND applications.keyval < ?)", [keyval]
+        return (f"({sort_expr} < ? OR {sort_expr} IS NULL OR ({sort_expr} = ? AND applications.keyval < ?))",
+                [value, value, keyval])
+    if value is None:
+        return f"({sort_expr} IS NOT NULL OR applications.keyval > ?)", [keyval]
+    return f"({sort_expr} > ? OR ({sort_expr} = ? AND applications.keyval > ?))", [value, value, keyval]
+
+def status_stats(counts):
+    """/api/data stats from (status, count) pairs."""
+    happ_count = pending_count = ref_count = total_matches = 0
+    for status, c in counts:
+        total_matches += c
+        if status == 'HAPP': happ_count += c
+        elif status in ['Pending', 'PCO', 'W', None, 'Unknown']: pending_count += c
+        elif status == 'REF': ref_count += c
+    return {
+        'total_loaded': total_matches,
+        'happ_count': happ_count,
+        'pending_count': pending_count,
+        'ref_count': ref_count
+    }
+
+def query_applications(conn, statuses=(), search_term='', agent_filter='', start_date='', end_date='',
+                       sort_field='received_date', sort_dir='desc', limit=50, after=None, agent_id=None,
+                       bbox=None, near=None, radius=None, nearest=None):
+    """
+    Filtered, sorted page of applications plus the HAPP/pending/REF breakdown of the whole match set.
+    Two statements: one GROUP BY pass for the stats, one keyset-paginated page query
+    (`after` = decoded cursor of the previous page's last row).
+    `agent_id` (normalized agent) takes precedence over the free-text `agent_filter`.
+    Location (geo.py): `bbox` (min_lon, min_lat, max_lon, max_lat); `near` (lat, lon) with
+    `radius` metres and/or the `nearest` N matches. sort_field='distance' (implied by `nearest`)
+    orders by distance from `near` as a single page without a cursor; for `nearest`
+    the stats describe the returned rows.
+    Returns (rows, stats, next_cursor).
+    """
     # 1. Build Base Clause
+    from_sql = "applications"
     where_clauses = ["1=1"]
     params = []
     
@@ -105,8 +254,6 @@ def get_data():
         # Handle 'PENDING' special group if present
         # If mixed with others, it's tricky. Let's assume user selects precise statuses OR 'Starting Groups'.
         # For now, simplistic IN clause, unless 'PENDING' string is passed.
-        
-        status_placeholders = []
         pending_logic = False
         
         cleaned_statuses = []
@@ -122,21 +269,42 @@ def get_data():
             # Params added later
             
             if pending_logic:
-                clause = f"({clause} OR status IN ('Pending', 'PCO', 'W', 'Unknown') OR status IS NULL)"
+                clause = f"({clause} OR status IN {PENDING_STATUSES} OR status IS NULL)"
             
             where_clauses.append(clause)
             params.extend(cleaned_statuses)
         elif pending_logic:
-             where_clauses.append("(status IN ('Pending', 'PCO', 'W', 'Unknown') OR status IS NULL)")
+             where_clauses.append(f"(status IN {PENDING_STATUSES} OR status IS NULL)")
     
     # Search (Proposal, Address, Ref, Keyval)
-    if search_term:
+    # Uses the FTS5 index (prefix match per word, ranked); LIKE scan only if the index is missing
+    match_expr = database.fts_match_expression(search_term) if search_term else None
+    if match_expr and database.has_search_index(conn):
+        from_sql = "applications JOIN applications_fts ON applications_fts.rowid = applications.rowid"
+        where_clauses.append("applications_fts MATCH ?")
+        params.append(match_expr)
+    elif search_term:
         term = f"%{search_term}%"
-        where_clauses.append("(proposal LIKE ? OR address LIKE ? OR reference LIKE ? OR keyval LIKE ?)")
+        where_clauses.append("(applications.proposal LIKE ? OR applications.address LIKE ? OR applications.reference LIKE ? OR applications.keyval LIKE ?)")
         params.extend([term, term, term, term])
+
+    # Sort: rank for relevance (lower is better), otherwise the date column; keyval breaks ties
+    if sort_field == 'relevance':
+        if from_sql == "applications":
+            sort_field = 'received_date'
+        else:
+            sort_dir = 'asc'
+    sort_expr = "applications_fts.rank" if sort_field == 'relevance' else f"applications.{sort_field}"
         
     # Agent
-    if agent_filter:
+    # Agent: indexed equality on the normalized agent_id (any known spelling of the name
+    # resolves to it); LIKE on the raw name only for text that isn't a known agent
+    if agent_id is None and agent_filter:
+        agent_id = agents.lookup(conn, agent_filter)
+    if agent_id is not None:
+        where_clauses.append("applications.agent_id = ?")
+        params.append(agent_id)
+    elif agent_filter:
         term = f"%{agent_filter}%"
         where_clauses.append("agent_name LIKE ?")
         params.append(term)
@@ -148,87 +316,129 @@ def get_data():
     if end_date:
         where_clauses.append("received_date <= ?")
         params.append(end_date)
+
+    # Location: R*Tree candidates, then exact box / distance tests (last, so `nearest`
+    # counts only rows that pass every other filter)
+    if bbox:
+        clause, extra = geo.bbox_clause(conn, bbox)
+        where_clauses.append(clause)
+        params.extend(extra)
+    if near:
+        lat, lon = near
+        if nearest and not radius:
+            base_where = " AND ".join(where_clauses)
+            def count_in_box(box):
+                clause, extra = geo.bbox_clause(conn, box)
+                return conn.execute(f"SELECT count(*) FROM {from_sql} WHERE {base_where} AND {clause}",
+                                    params + extra).fetchone()[0]
+            radius = geo.nearest_radius(count_in_box, lat, lon, nearest)
+        radius = min(radius or geo.MAX_RADIUS_M, geo.MAX_RADIUS_M)
+        clause, extra = geo.bbox_clause(conn, geo.box_around(lat, lon, radius))
+        dist_sql, dist_params = geo.distance2_sql(lat, lon)
+        where_clauses.append(f"{clause} AND {dist_sql} <= ?")
+        params.extend(extra + dist_params + [radius * radius])
+        if nearest:
+            sort_field, limit = 'distance', nearest
+    elif sort_field == 'distance':
+        sort_field = 'received_date'
         
     where_sql = " AND ".join(where_clauses)
+    cols = ', '.join(f"applications.{c}" for c in LIST_COLUMNS)
+
+    if sort_field == 'distance':
+        rows = conn.execute(f"""
+            SELECT {cols}, {dist_sql} AS sort_value
+            FROM {from_sql} WHERE {where_sql}
+            ORDER BY sort_value, applications.keyval
+            LIMIT ?
+        """, dist_params + params + [limit]).fetchall()
+        if nearest:
+            counts = {}
+            for row in rows:
+                counts[row['status']] = counts.get(row['status'], 0) + 1
+            return rows, status_stats(counts.items()), None
+        stats = status_stats(conn.execute(
+            f"SELECT status, count(*) FROM {from_sql} WHERE {where_sql} GROUP BY status", params))
+        return rows, stats, None
     
-    # 2. Stats Query (Count total matches before limit)
-    count_query = f"SELECT count(*) FROM applications WHERE {where_sql}"
-    # Breakdown stats?
-    # Calculating breakdown for arbitrary filter is expensive (requires Group By).
-    # Group By Status
-    stats_query = f"SELECT status, count(*) FROM applications WHERE {where_sql} GROUP BY status"
-    
-    total_matches = cursor.execute(count_query, params).fetchone()[0]
+    # 2. Stats: total + breakdown from one GROUP BY pass (index-only on status when unfiltered);
+    # the cursor predicate is not applied, so every page reports the whole match set
+    stats = status_stats(conn.execute(
+        f"SELECT status, count(*) FROM {from_sql} WHERE {where_sql} GROUP BY status", params))
+
+    # 3. Fetch Page (keyset pagination: continue after the previous page's last row)
+    page_where, page_params = where_sql, list(params)
+    if after:
+        clause, extra = _keyset_clause(sort_expr, sort_dir, after)
+        page_where += f" AND {clause}"
+        page_params.extend(extra)
+    rows = conn.execute(f"""
+        SELECT {cols}, {sort_expr} AS sort_value
+        FROM {from_sql} WHERE {page_where}
+        ORDER BY {sort_expr} {sort_dir}, applications.keyval {sort_dir}
+        LIMIT ?
+    """, page_params + [limit]).fetchall()
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1]['sort_value'], rows[-1]['keyval'])
+    return rows, stats, next_cursor
+
+@app.route('/api/data')
+def get_data():
+    # Filters
+    # Handle both 'status' and 'status[]' conventions just in case, but standard is same key multiple times
+    statuses = request.args.getlist('status') 
+    # If no status passed, or ['ALL'], default to ALL (no filter)
+    if 'ALL' in statuses or not statuses:
+        statuses = []
+        
+    try:
+        limit = int(request.args.get('limit', 50))
+    except: limit = 50
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    sort_dir = request.args.get('sort_dir', request.args.get('sort', 'desc')).lower()
+    if sort_dir not in ['asc', 'desc']: sort_dir = 'desc'
     
-    # Run breakdown
-    # Reuse params!
-    # SQLite cursor.execute requires fresh params list usually ok to reuse? Yes.
-    stat_rows = cursor.execute(stats_query, params).fetchall()
+    search_term = request.args.get('search', '').strip()
     
-    happ_count = 0
-    pending_count = 0
-    ref_count = 0
+    # 'relevance' ranks full-text matches (default when searching without an explicit sort)
+    sort_field = request.args.get('sort_by', 'relevance' if search_term else 'received_date')
+    valid_sorts = ['received_date', 'validated_date', 'decision_date', 'relevance', 'distance']
+    if sort_field not in valid_sorts: sort_field = 'received_date'
     
-    for r in stat_rows:
-        s = r['status']
-        c = r[1]
-        if s == 'HAPP': happ_count += c
-        elif s in ['Pending', 'PCO', 'W', None, 'Unknown']: pending_count += c
-        elif s == 'REF': ref_count += c
-        
-    stats = {
-        'total_loaded': total_matches,
-        'happ_count': happ_count,
-        'pending_count': pending_count,
-        'ref_count': ref_count
-    }
+    cursor_token = request.args.get('cursor', '')
+    after = decode_cursor(cursor_token) if cursor_token else None
 
-    # 3. Fetch Data
-    query = f"SELECT * FROM applications WHERE {where_sql} ORDER BY {sort_field} {sort_dir}"
-    
-    try:
-        limit = int(limit)
-    except: limit = 50
-    query += f" LIMIT {limit}"
+    # Location: bbox=west,south,east,north and/or lat+lon with radius (metres) or nearest=N
+    bbox = None
+    if request.args.get('bbox'):
+        bbox = geo.parse_bbox(request.args['bbox'])
+        if not bbox:
+            return jsonify({'error': 'bbox must be west,south,east,north in degrees'}), 400
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius = request.args.get('radius', type=float)
+    nearest = request.args.get('nearest', type=int)
+    near = (lat, lon) if lat is not None and lon is not None else None
+    if (radius or nearest) and not near:
+        return jsonify({'error': 'radius / nearest need lat and lon'}), 400
+    if nearest:
+        nearest = max(1, min(nearest, geo.MAX_NEAREST))
     
-    rows = cursor.execute(query, params).fetchall()
+    conn = get_db(readonly=True)
+    rows, stats, next_cursor = query_applications(
+        conn, statuses=statuses, search_term=search_term,
+        agent_filter=request.args.get('agent', '').strip(), agent_id=request.args.get('agent_id', type=int),
+        start_date=request.args.get('start_date', ''), end_date=request.args.get('end_date', ''),
+        sort_field=sort_field, sort_dir=sort_dir, limit=limit, after=after,
+        bbox=bbox, near=near, radius=radius, nearest=nearest
+    )
 
     # 3. Format Records
     records = []
 
-    def fmt_date(d_str):
-        if not d_str: return '-'
-        s = str(d_str).strip()
-        if not s or s == 'None': return '-'
-        
-        # Remove time if present
-        s = s.split('T')[0].split(' ')[0]
-        
-        # Normalize separators to slash
-        s_clean = s.replace('-', '/')
-        
-        try:
-            parts = s_clean.split('/')
-            if len(parts) == 3:
-                p0, p1, p2 = int(parts[0]), int(parts[1]), int(parts[2])
-                
-                day, month, year = 0, 0, 0
-                
-                # Check for Year at start (YYYY/MM/DD)
-                if p0 > 31: 
-                    year, month, day = p0, p1, p2
-                else: 
-                    # Assume DD/MM/YYYY (UK standard)
-                    day, month, year = p0, p1, p2
-                
-                # Expand 2-digit year
-                if year < 100: year += 2000
-                
-                return f"{day:02d}/{month:02d}/{year:04d}"
-        except: pass
-        
-        return s
-
     for row in rows:
         scraped_needed = False
         if not row['agent_name'] or row['needs_scrape']:
@@ -248,10 +458,10 @@ def get_data():
             'keyval': row['keyval'], 
             'status': row['status'] or 'Unknown',
             'proposal': row['proposal'] or '',
-            'date': fmt_date(row['received_date']), # Fallback for sorting logic
-            'received_date_fmt': fmt_date(row['received_date']),
-            'validated_date_fmt': fmt_date(row['validated_date']),
-            'decision_date_fmt': fmt_date(row['decision_date']),
+            'date': row['received_date_fmt'], # Fallback for sorting logic
+            'received_date_fmt': row['received_date_fmt'],
+            'validated_date_fmt': row['validated_date_fmt'],
+            'decision_date_fmt': row['decision_date_fmt'],
             'address': addr_disp,
             'agent': agent_disp,
             'lat': row['latitude'],
@@ -260,9 +470,11 @@ def get_data():
             'council_url': council_url,
             'validation_warning': row['validation_warning']
         })
+        if near:
+            d = geo.distance_m(lat, lon, row['latitude'], row['longitude'])
+            records[-1]['distance_m'] = round(d) if d is not None else None
     
-    conn.close()
-    return jsonify({'records': records, 'stats': stats})
+    return jsonify({'records': records, 'stats': stats, 'next_cursor': next_cursor})
 
 @app.route('/api/fetch-address/<keyval>')
 def fetch_address(keyval):
@@ -299,17 +511,21 @@ def fetch_address(keyval):
         elif 'approved' in scraped_st and api_status not in ['HAPP', 'PER', 'NOBJ']:
              validation_msg = f"Mismatch: Portal says '{data['scraped_status']}', API says '{api_status}'"
 
+        agent_id = agents.resolve(conn, data['agent'])
         cursor.execute("""
             UPDATE applications SET 
             address = ?, 
             agent_name = ?, 
+            agent_id = ?,
             decision_date = ?,
             last_scraped_details = ?,
             needs_scrape = 0,
             portal_keyval = COALESCE(?, portal_keyval),
             validation_warning = ?
             WHERE keyval = ?
-        """, (data['address'], data['agent'], db_date, datetime.now(), portal_keyval, validation_msg, keyval))
+        """, (data['address'], data['agent'], agent_id, db_date, datetime.now(), portal_keyval, validation_msg, keyval))
+        scrape_queue.mark_done(conn, [keyval])
+        database.refresh_agent_stats(conn)
         conn.commit()
         
         # Return updated URL & Warning
@@ -323,19 +539,21 @@ def fetch_address(keyval):
             'council_url': new_url,
             'validation_warning': validation_msg
         }
+    elif row:
+        # Hand the failure to the queue so the background enricher retries it with backoff
+        scrape_queue.mark_failed(conn, [(keyval, data.get('error'))])
+        conn.commit()
     
-    conn.close()
     return jsonify(response_data)
 
 @app.route('/api/application/<keyval>')
 def get_application_details(keyval):
-    conn = get_db()
+    conn = get_db(readonly=True)
     cursor = conn.cursor()
     
     # Fetch Main Record
     row = cursor.execute("SELECT * FROM applications WHERE keyval = ?", (keyval,)).fetchone()
     if not row:
-        conn.close()
         return jsonify({'error': 'Not found'}), 404
         
     # Convert Row to dict
@@ -343,16 +561,14 @@ def get_application_details(keyval):
     
     # Fetch History
     try:
-        history_rows = cursor.execute("SELECT * FROM status_history WHERE keyval = ? ORDER BY change_date DESC", (keyval,)).fetchall()
-        history = [dict(r) for r in history_rows]
+        history_rows = history.for_application(conn, keyval)
+        transitions = history.without_bounces([dict(r) for r in history_rows])
     except:
-        history = []
-    
-    conn.close()
+        transitions = []
     
     return jsonify({
         'application': app_data,
-        'history': history
+        'history': transitions
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+"""
+Map clusters: applications pre-aggregated into grid cells per zoom level, so a map
+downloads one row per cell (count, status mix, newest received date, centroid)
+instead of every point.
+
+Cells are slippy-map tiles: the cell (level, x, y) is the web-mercator tile x/y at zoom
+`level`, for MIN_LEVEL..MAX_LEVEL. A map at zoom z shows level z + ZOOM_OFFSET, i.e.
+about 64 px cells. The levels form a quadtree: only MAX_LEVEL cells are computed from
+applications, every coarser cell is the sum of its four children.
+
+Triggers put the old and new coordinates of every application inserted, deleted or
+changed (position, status, received date) into cluster_dirty; refresh() recomputes
+just the MAX_LEVEL cells containing those points and rolls the change up the tree.
+"""
+import math
+
+import database
+import geo
+
+MIN_LEVEL = 10
+MAX_LEVEL = 18 # ~100 m cells at York's latitude
+ZOOM_OFFSET = 2
+REBUILD_CELLS = 5000 # more dirty cells than this: rebuild everything in one pass
+PENDING_STATUSES = ('Pending', 'PCO', 'W', 'Unknown') # as app.PENDING_STATUSES, plus NULL
+COLUMNS = ['x', 'y', 'lat', 'lon', 'count', 'approved', 'refused', 'pending', 'newest']
+
+def tile(lat, lon, level):
+    """Web-mercator tile (x, y) containing a point at zoom `level`."""
+    n = 1 << level
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tile_bounds(x, y, level):
+    """(min_lon, min_lat, max_lon, max_lat) of a tile."""
+    n = 1 << level
+    def lat_at(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return x / n * 360.0 - 180.0, lat_at(y + 1), (x + 1) / n * 360.0 - 180.0, lat_at(y)
+
+def level_for_zoom(zoom):
+    return min(max(zoom + ZOOM_OFFSET, MIN_LEVEL), MAX_LEVEL)
+
+def _aggregate(rows, level=MAX_LEVEL, only=None):
+    """(lat, lon, status, received_date) rows -> {(x, y): [count, approved, refused, pending, newest, lat_sum, lon_sum]}."""
+    cells = {}
+    for lat, lon, status, received in rows:
+        key = tile(lat, lon, level)
+        if only is not None and key != only:
+            continue
+        c = cells.get(key)
+        if c is None:
+            c = cells[key] = [0, 0, 0, 0, None, 0.0, 0.0]
+        c[0] += 1
+        if status in database.APPROVED_STATUSES:
+            c[1] += 1
+        elif status in database.REFUSED_STATUSES:
+            c[2] += 1
+        elif status is None or status in PENDING_STATUSES:
+            c[3] += 1
+        if received and (c[4] is None or received > c[4]):
+            c[4] = received
+        c[5] += lat
+        c[6] += lon
+    return cells
+
+def _insert_cells(conn, level, cells):
+    conn.executemany("""
+        INSERT INTO cluster_cells (level, x, y, count, approved, refused, pending, newest, lat_sum, lon_sum)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(level, x, y, *c) for (x, y), c in cells.items()])
+
+def _roll_up(conn, dirty):
+    """Recomputes the ancestors of the dirty MAX_LEVEL cells, one set-based pass per level."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS cluster_parents (x INTEGER, y INTEGER, PRIMARY KEY (x, y))")
+    for level in range(MAX_LEVEL - 1, MIN_LEVEL - 1, -1):
+        dirty = {(x >> 1, y >> 1) for x, y in dirty}
+        conn.execute("DELETE FROM temp.cluster_parents")
+        conn.executemany("INSERT INTO temp.cluster_parents (x, y) VALUES (?, ?)", dirty)
+        conn.execute("""
+            DELETE FROM cluster_cells WHERE level = ?
+            AND EXISTS (SELECT 1 FROM temp.cluster_parents p WHERE p.x = cluster_cells.x AND p.y = cluster_cells.y)
+        """, (level,))
+        conn.execute("""
+            INSERT INTO cluster_cells (level, x, y, count, approved, refused, pending, newest, lat_sum, lon_sum)
+            SELECT ?, p.x, p.y, sum(c.count), sum(c.approved), sum(c.refused), sum(c.pending), max(c.newest),
+                   sum(c.lat_sum), sum(c.lon_sum)
+            FROM temp.cluster_parents p
+            JOIN cluster_cells c ON c.level = ? AND c.x IN (p.x * 2, p.x * 2 + 1) AND c.y IN (p.y * 2, p.y * 2 + 1)
+            GROUP BY p.x, p.y
+        """, (level, level + 1))
+
+def rebuild(conn):
+    """Recomputes every cell of every level from scratch (caller commits). Returns the number of MAX_LEVEL cells."""
+    conn.execute("DELETE FROM cluster_cells")
+    conn.execute("DELETE FROM cluster_dirty")
+    cells = _aggregate(conn.execute(
+        f"SELECT latitude, longitude, status, received_date FROM applications WHERE {geo.LOCATED}"))
+    _insert_cells(conn, MAX_LEVEL, cells)
+    _roll_up(conn, set(cells))
+    return len(cells)
+
+def refresh(conn):
+    """
+    Brings the cells in line with the applications changed since the last refresh
+    (caller commits). Returns the number of MAX_LEVEL cells recomputed.
+    """
+    points = conn.execute("SELECT DISTINCT lat, lon FROM cluster_dirty").fetchall()
+    if not points:
+        return 0
+    dirty = {tile(lat, lon, MAX_LEVEL) for lat, lon in points}
+    if len(dirty) > REBUILD_CELLS:
+        return rebuild(conn)
+
+    box = geo.extent(conn) # once: the cell writes below would invalidate its per-connection cache
+    for x, y in dirty:
+        # R*Tree candidates in the tile's box, then the exact tile test (points on an edge belong to one tile)
+        clause, params = geo.bbox_clause(conn, tile_bounds(x, y, MAX_LEVEL), box)
+        cells = _aggregate(conn.execute(
+            f"SELECT latitude, longitude, status, received_date FROM applications WHERE {clause}", params),
+            only=(x, y))
+        conn.execute("DELETE FROM cluster_cells WHERE level = ? AND x = ? AND y = ?", (MAX_LEVEL, x, y))
+        _insert_cells(conn, MAX_LEVEL, cells)
+    _roll_up(conn, dirty)
+    conn.execute("DELETE FROM cluster_dirty")
+    return len(dirty)
+
+def cells(conn, level, bbox=None):
+    """Cells of one level as rows in COLUMNS order (centroid lat/lon), optionally only those overlapping bbox."""
+    sql = "SELECT x, y, count, approved, refused, pending, newest, lat_sum, lon_sum FROM cluster_cells WHERE level = ?"
+    params = [level]
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        x0, y0 = tile(max_lat, min_lon, level) # tile y grows southwards
+        x1, y1 = tile(min_lat, max_lon, level)
+        sql += " AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?"
+        params += [x0, x1, y0, y1]
+    return [[x, y, round(lat_sum / count, 6), round(lon_sum / count, 6), count, approved, refused, pending, newest]
+            for x, y, count, approved, refused, pending, newest, lat_sum, lon_sum
+            in conn.execute(sql + " ORDER BY x, y", params)]
@@ -1,16 +1,609 @@
 import sqlite3
 import os
-from datetime import datetime
+import re
+import threading
+from datetime import date, datetime
 
 DB_NAME = "construction_intelligence.db"
+HISTORY_ARCHIVE = 'history_archive' # schema name of the attached status_history archive (history.py)
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Applied once to every new connection (journal_mode=WAL is persistent and set by init_db)
+CONNECTION_PRAGMAS = [
+    ('busy_timeout', 5000),       # wait for the writer instead of failing with "database is locked"
+    ('synchronous', 'NORMAL'),    # safe with WAL, avoids an fsync per commit
+    ('cache_size', -16000),       # ~16 MB page cache
+    ('mmap_size', 134217728),     # 128 MB memory-mapped reads
+    ('temp_store', 'MEMORY'),     # staging tables / sorts stay in RAM
+]
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that can be weakly referenced, so per-connection caches (geo.extent) go away with it."""
+
+def connect(db_name=None, readonly=False, check_same_thread=True):
+    """
+    The one place connections are opened: Row factory + CONNECTION_PRAGMAS.
+    readonly=True opens the file with mode=ro, so a GET handler can never write.
+    """
+    path = db_name or DB_NAME
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=check_same_thread,
+                               factory=Connection)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=check_same_thread, factory=Connection)
     conn.row_factory = sqlite3.Row
+    for name, value in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    if os.path.exists(history_archive_path(path)):
+        attach_history_archive(conn, path, readonly=readonly)
     return conn
 
-def init_db():
-    conn = get_db_connection()
+def history_archive_path(db_name=None):
+    """Archived status_history rows live next to the DB: construction_intelligence_history.db."""
+    return f"{os.path.splitext(db_name or DB_NAME)[0]}_history.db"
+
+def attach_history_archive(conn, db_name=None, readonly=False):
+    """Attaches (creating it unless readonly) the history archive as HISTORY_ARCHIVE. No-op if already attached."""
+    if any(r[1] == HISTORY_ARCHIVE for r in conn.execute("PRAGMA database_list")):
+        return
+    path = history_archive_path(db_name)
+    if readonly:
+        conn.execute(f"ATTACH DATABASE ? AS {HISTORY_ARCHIVE}", (f"file:{path}?mode=ro",))
+    else:
+        conn.execute(f"ATTACH DATABASE ? AS {HISTORY_ARCHIVE}", (path,))
+
+def history_source(conn):
+    """
+    FROM-clause source for every status_history row: the live table, plus the archive when
+    it is attached. Filters on keyval / change_date are pushed into both halves, so both
+    use their (keyval, change_date) index.
+    """
+    if not any(r[1] == HISTORY_ARCHIVE for r in conn.execute("PRAGMA database_list")):
+        return "status_history"
+    columns = "id, keyval, old_status, new_status, change_date"
+    return (f"(SELECT {columns} FROM main.status_history "
+            f"UNION ALL SELECT {columns} FROM {HISTORY_ARCHIVE}.status_history)")
+
+def get_db_connection(db_name=None):
+    """Dedicated read/write connection (scripts, the sync job and its background thread)."""
+    return connect(db_name)
+
+class ConnectionPool:
+    """
+    Reusable connections for the web app. acquire() hands an idle connection
+    (or a new one) to the calling request; release() rolls back anything left
+    open and keeps it for the next request, up to max_idle connections.
+    A connection is only used by one thread at a time, but may move between
+    the server's worker threads, hence check_same_thread=False.
+    """
+    def __init__(self, db_name=None, readonly=False, max_idle=8):
+        self.db_name = db_name
+        self.readonly = readonly
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return connect(self.db_name, readonly=self.readonly, check_same_thread=False)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+DATE_COLUMNS = ['received_date', 'validated_date', 'decision_date']
+ISO_DATE_GLOB = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+
+def normalize_date(value):
+    """
+    Canonical ISO date ('YYYY-MM-DD') for anything we store in a date column:
+    date/datetime objects, 'YYYY-MM-DD...', 'YYYY/MM/DD...', 'DD/MM/YYYY' or 'DD/MM/YY'.
+    Returns None for empty or unparseable values.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    s = str(value).strip()
+    if not s or s in ('None', 'nan', 'NaT', '-'):
+        return None
+
+    # Remove time if present, normalize separators
+    s = s.split('T')[0].split(' ')[0].replace('/', '-')
+    try:
+        p0, p1, p2 = (int(p) for p in s.split('-'))
+    except ValueError:
+        return None
+    if p0 > 31:
+        year, month, day = p0, p1, p2
+    else:
+        # Assume DD/MM/YYYY (UK standard)
+        day, month, year = p0, p1, p2
+    if year < 100: year += 2000
+    try:
+        return date(year, month, day).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+def display_date_sql(col):
+    """SQL expression rendering an ISO date column as DD/MM/YYYY ('-' when empty)."""
+    return (f"CASE WHEN {col} IS NULL OR {col} = '' THEN '-' "
+            f"ELSE substr({col}, 9, 2) || '/' || substr({col}, 6, 2) || '/' || substr({col}, 1, 4) END")
+
+def repair_dates(conn):
+    """Rewrites non-ISO values in the date columns as ISO (unparseable -> NULL). Returns rows fixed."""
+    fixed = 0
+    for col in DATE_COLUMNS:
+        rows = conn.execute(
+            f"SELECT keyval, {col} FROM applications WHERE {col} IS NOT NULL AND {col} NOT GLOB '{ISO_DATE_GLOB}'"
+        ).fetchall()
+        if rows:
+            conn.executemany(f"UPDATE applications SET {col} = ? WHERE keyval = ?",
+                             [(normalize_date(r[1]), r[0]) for r in rows])
+            fixed += len(rows)
+    return fixed
+
+def get_sync_state(conn, key, default=None):
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_sync_state(conn, key, value):
+    """Upserts a checkpoint value (caller commits)."""
+    conn.execute("""
+        INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """, (key, None if value is None else str(value), datetime.now()))
+
+def fts_match_expression(search_term):
+    """
+    Turns free text into an FTS5 MATCH expression: every word becomes a quoted
+    prefix term ("ext"* matches extension), all terms must match.
+    Returns None when the text has no searchable words.
+    """
+    tokens = re.findall(r'\w+', search_term.lower())
+    if not tokens:
+        return None
+    return ' '.join(f'"{t}"*' for t in tokens)
+
+def has_search_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'applications_fts'").fetchone() is not None
+
+def rebuild_search_index(conn):
+    """Re-reads every application into the FTS index (after bulk loads or a VACUUM renumbering rowids)."""
+    conn.execute("INSERT INTO applications_fts(applications_fts) VALUES('rebuild')")
+
+def init_search_index(cursor):
+    """
+    FTS5 index over proposal/address/reference/keyval (external content on `applications`,
+    rowid-aligned, kept in step by triggers). Prefix indexes keep "ext"* style queries fast.
+    """
+    existed = has_search_index(cursor)
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS applications_fts USING fts5(
+            proposal, address, reference, keyval,
+            content='applications', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: app.get_data falls back to LIKE
+        print(f"Search index unavailable: {e}")
+        return
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS applications_fts_ai AFTER INSERT ON applications BEGIN
+        INSERT INTO applications_fts(rowid, proposal, address, reference, keyval)
+        VALUES (new.rowid, new.proposal, new.address, new.reference, new.keyval);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS applications_fts_ad AFTER DELETE ON applications BEGIN
+        INSERT INTO applications_fts(applications_fts, rowid, proposal, address, reference, keyval)
+        VALUES ('delete', old.rowid, old.proposal, old.address, old.reference, old.keyval);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS applications_fts_au AFTER UPDATE OF proposal, address, reference, keyval ON applications BEGIN
+        INSERT INTO applications_fts(applications_fts, rowid, proposal, address, reference, keyval)
+        VALUES ('delete', old.rowid, old.proposal, old.address, old.reference, old.keyval);
+        INSERT INTO applications_fts(rowid, proposal, address, reference, keyval)
+        VALUES (new.rowid, new.proposal, new.address, new.reference, new.keyval);
+    END
+    ''')
+
+    if not existed:
+        print("Migrating: Building full-text search index...")
+        rebuild_search_index(cursor)
+
+def has_spatial_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'applications_geo'").fetchone() is not None
+
+def rebuild_spatial_index(conn):
+    """Re-reads every located application into the R*Tree (after bulk loads or a VACUUM renumbering rowids)."""
+    conn.execute("DELETE FROM applications_geo")
+    conn.execute("""
+        INSERT INTO applications_geo (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT rowid, latitude, latitude, longitude, longitude FROM applications
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """)
+
+def init_spatial_index(cursor):
+    """
+    R*Tree over the application coordinates (id = applications.rowid, a point is a
+    zero-size box), kept in step by triggers; queried through geo.py.
+    """
+    existed = has_spatial_index(cursor)
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS applications_geo USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite built without R*Tree: geo.bbox_clause falls back to a lat/lon range scan
+        print(f"Spatial index unavailable: {e}")
+        return
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS applications_geo_ai AFTER INSERT ON applications
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+        INSERT INTO applications_geo (id, min_lat, max_lat, min_lon, max_lon)
+        VALUES (new.rowid, new.latitude, new.latitude, new.longitude, new.longitude);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS applications_geo_ad AFTER DELETE ON applications BEGIN
+        DELETE FROM applications_geo WHERE id = old.rowid;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS applications_geo_au AFTER UPDATE OF latitude, longitude ON applications
+    WHEN old.latitude IS NOT new.latitude OR old.longitude IS NOT new.longitude BEGIN
+        DELETE FROM applications_geo WHERE id = old.rowid;
+        INSERT INTO applications_geo (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT new.rowid, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    ''')
+
+    # Status breakdown of a map view covering every located application (see geo.py)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_located_status ON applications(status) '
+                   'WHERE latitude IS NOT NULL AND longitude IS NOT NULL;')
+
+    if not existed:
+        print("Migrating: Building spatial index...")
+        rebuild_spatial_index(cursor)
+
+# Decision outcomes counted in agent_stats
+APPROVED_STATUSES = ('HAPP', 'PER', 'PERLHE', 'NOB', 'NOBJ', 'CER')
+REFUSED_STATUSES = ('REF', 'HREF', 'REFLHE')
+
+def refresh_agent_stats(conn):
+    """
+    Recomputes agent_stats for the agents the triggers marked dirty (and only those):
+    counts, approvals / refusals and the median days from validation (else receipt)
+    to decision. Returns the number of agents refreshed (caller commits).
+    """
+    if not conn.execute("SELECT 1 FROM agent_stats_dirty LIMIT 1").fetchone():
+        return 0
+    conn.execute("DELETE FROM agent_stats WHERE agent_id IN (SELECT agent_id FROM agent_stats_dirty)")
+    conn.execute(f"""
+        WITH apps AS (
+            SELECT a.agent_id, a.status, a.decision_date,
+                   julianday(a.decision_date) - julianday(coalesce(a.validated_date, a.received_date)) AS days
+            FROM agent_stats_dirty d JOIN applications a ON a.agent_id = d.agent_id
+        ),
+        timed AS (
+            SELECT agent_id, days,
+                   row_number() OVER (PARTITION BY agent_id ORDER BY days) AS n,
+                   count(*) OVER (PARTITION BY agent_id) AS total
+            FROM apps WHERE days >= 0
+        ),
+        medians AS (
+            SELECT agent_id, avg(days) AS median_days FROM timed
+            WHERE n IN ((total + 1) / 2, (total + 2) / 2) GROUP BY agent_id
+        ),
+        counts AS (
+            SELECT agent_id, count(*) AS applications,
+                   sum(status IN {APPROVED_STATUSES}) AS approved,
+                   sum(status IN {REFUSED_STATUSES}) AS refused,
+                   sum(decision_date IS NOT NULL OR status IN {APPROVED_STATUSES + REFUSED_STATUSES}) AS decided
+            FROM apps GROUP BY agent_id
+        )
+        INSERT INTO agent_stats (agent_id, applications, approved, refused, decided, median_decision_days, updated_at)
+        SELECT c.agent_id, c.applications, c.approved, c.refused, c.decided, m.median_days, ?
+        FROM counts c LEFT JOIN medians m ON m.agent_id = c.agent_id
+    """, (datetime.now(),))
+    return conn.execute("DELETE FROM agent_stats_dirty").rowcount
+
+def init_agents(cursor):
+    """
+    agents (one row per canonical agent) + agent_aliases (every raw spelling -> agent),
+    filled by agents.py. Existing rows are normalized once, when agent_id is first added.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agents (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL, -- display name: the most common spelling
+        canonical TEXT NOT NULL UNIQUE, -- agents.canonical_key()
+        created_at TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agent_aliases (
+        alias TEXT PRIMARY KEY, -- agent_name exactly as scraped
+        agent_id INTEGER NOT NULL
+    )
+    ''')
+
+    columns = [r[1] for r in cursor.execute("PRAGMA table_xinfo(applications)")]
+    if 'agent_id' not in columns:
+        print("Migrating: Adding 'agent_id' column and normalizing agent names...")
+        cursor.execute("ALTER TABLE applications ADD COLUMN agent_id INTEGER")
+        import agents  # agents.py imports this module
+        result = agents.renormalize(cursor)
+        print(f"Migrating: {result['names']} agent spellings -> {result['agents']} agents.")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_agent_id_received ON applications(agent_id, received_date);')
+    # Covering index for the status breakdown of an agent-filtered /api/data query
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_agent_id_status ON applications(agent_id, status);')
+
+def init_agent_stats(cursor):
+    """
+    agent_stats: one row per agent, maintained incrementally. Triggers on applications
+    put every agent whose applications were inserted, deleted or had their agent, status
+    or dates changed into agent_stats_dirty; refresh_agent_stats() recomputes just those.
+    """
+    existed = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'agent_stats'").fetchone()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agent_stats (
+        agent_id INTEGER PRIMARY KEY,
+        applications INTEGER NOT NULL,
+        approved INTEGER NOT NULL,
+        refused INTEGER NOT NULL,
+        decided INTEGER NOT NULL, -- has a decision date or a decided status
+        median_decision_days REAL, -- validated (else received) -> decision, NULL if nothing decided
+        updated_at TIMESTAMP
+    )
+    ''')
+    cursor.execute('CREATE TABLE IF NOT EXISTS agent_stats_dirty (agent_id INTEGER PRIMARY KEY)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_agent_stats_applications ON agent_stats(applications DESC);')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS agent_stats_ai AFTER INSERT ON applications
+    WHEN new.agent_id IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO agent_stats_dirty (agent_id) VALUES (new.agent_id);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS agent_stats_ad AFTER DELETE ON applications
+    WHEN old.agent_id IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO agent_stats_dirty (agent_id) VALUES (old.agent_id);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS agent_stats_au AFTER UPDATE OF agent_id, status, received_date, validated_date, decision_date ON applications
+    WHEN old.agent_id IS NOT new.agent_id OR old.status IS NOT new.status
+      OR old.received_date IS NOT new.received_date OR old.validated_date IS NOT new.validated_date
+      OR old.decision_date IS NOT new.decision_date BEGIN
+        INSERT OR IGNORE INTO agent_stats_dirty (agent_id)
+        SELECT old.agent_id WHERE old.agent_id IS NOT NULL
+        UNION SELECT new.agent_id WHERE new.agent_id IS NOT NULL;
+    END
+    ''')
+
+    if not existed:
+        print("Migrating: Building agent statistics...")
+        cursor.execute("INSERT OR IGNORE INTO agent_stats_dirty (agent_id) "
+                       "SELECT DISTINCT agent_id FROM applications WHERE agent_id IS NOT NULL")
+    refresh_agent_stats(cursor)
+
+def init_cluster_index(cursor):
+    """
+    cluster_cells: map cluster counts per zoom level and grid cell (see clusters.py).
+    Triggers put the old and new position of every application inserted, deleted or
+    moved / re-statused into cluster_dirty; clusters.refresh() recomputes just those cells.
+    """
+    existed = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'cluster_cells'").fetchone()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS cluster_cells (
+        level INTEGER NOT NULL, -- slippy-map zoom of the cell
+        x INTEGER NOT NULL,
+        y INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        approved INTEGER NOT NULL,
+        refused INTEGER NOT NULL,
+        pending INTEGER NOT NULL,
+        newest TEXT, -- latest received_date in the cell
+        lat_sum REAL NOT NULL, -- centroid = lat_sum / count
+        lon_sum REAL NOT NULL,
+        PRIMARY KEY (level, x, y)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE TABLE IF NOT EXISTS cluster_dirty (lat REAL, lon REAL)')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS cluster_dirty_ai AFTER INSERT ON applications
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+        INSERT INTO cluster_dirty (lat, lon) VALUES (new.latitude, new.longitude);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS cluster_dirty_ad AFTER DELETE ON applications
+    WHEN old.latitude IS NOT NULL AND old.longitude IS NOT NULL BEGIN
+        INSERT INTO cluster_dirty (lat, lon) VALUES (old.latitude, old.longitude);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS cluster_dirty_au AFTER UPDATE OF latitude, longitude, status, received_date ON applications
+    WHEN old.latitude IS NOT new.latitude OR old.longitude IS NOT new.longitude
+      OR old.status IS NOT new.status OR old.received_date IS NOT new.received_date BEGIN
+        INSERT INTO cluster_dirty (lat, lon)
+        SELECT old.latitude, old.longitude WHERE old.latitude IS NOT NULL AND old.longitude IS NOT NULL
+        UNION SELECT new.latitude, new.longitude WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    ''')
+
+    if not existed:
+        print("Migrating: Building map clusters...")
+        import clusters
+        clusters.rebuild(cursor)
+
+def init_analytics(cursor):
+    """
+    Decision-time analytics (analytics.py): decision_facts (one row per decided application),
+    decision_day_counts and decision_time_rollups (distribution per dimension / key / measure),
+    rolled up from the counts. Triggers mark
+    applications whose status, dates, agent or position changed, or that got a new
+    status_history row, in analytics_dirty; analytics.refresh() recomputes just those.
+    """
+    existed = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'decision_time_rollups'").fetchone()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS decision_facts (
+        keyval TEXT PRIMARY KEY,
+        status TEXT,
+        agent TEXT, -- agents.id as text, like every rollup key
+        area TEXT, -- map grid cell 'x/y' (analytics.AREA_LEVEL)
+        month TEXT, -- decision month 'YYYY-MM'
+        received_days REAL, -- received -> decided, NULL if unknown / negative
+        validated_days REAL
+    )
+    ''')
+    for column in ('status', 'agent', 'area', 'month'):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_decision_facts_{column} ON decision_facts({column});')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS decision_day_counts (
+        dimension TEXT NOT NULL,
+        key TEXT NOT NULL,
+        measure TEXT NOT NULL,
+        days INTEGER NOT NULL,
+        n INTEGER NOT NULL, -- applications of this group that took `days` days
+        PRIMARY KEY (dimension, key, measure, days)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS decision_time_rollups (
+        dimension TEXT NOT NULL, -- all / status / agent / area / month
+        key TEXT NOT NULL,
+        measure TEXT NOT NULL, -- received / validated (start of the interval)
+        decided INTEGER NOT NULL,
+        mean_days REAL,
+        p25 REAL,
+        median_days REAL,
+        p75 REAL,
+        p90 REAL,
+        histogram TEXT, -- JSON counts per analytics.HISTOGRAM_EDGES bucket
+        updated_at TIMESTAMP,
+        PRIMARY KEY (dimension, key, measure)
+    )
+    ''')
+    cursor.execute('CREATE TABLE IF NOT EXISTS analytics_dirty (keyval TEXT PRIMARY KEY)')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analytics_ai AFTER INSERT ON applications BEGIN
+        INSERT OR IGNORE INTO analytics_dirty (keyval) VALUES (new.keyval);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analytics_ad AFTER DELETE ON applications BEGIN
+        INSERT OR IGNORE INTO analytics_dirty (keyval) VALUES (old.keyval);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analytics_au AFTER UPDATE OF status, received_date, validated_date, decision_date,
+        agent_id, latitude, longitude ON applications
+    WHEN old.status IS NOT new.status OR old.received_date IS NOT new.received_date
+      OR old.validated_date IS NOT new.validated_date OR old.decision_date IS NOT new.decision_date
+      OR old.agent_id IS NOT new.agent_id OR old.latitude IS NOT new.latitude OR old.longitude IS NOT new.longitude BEGIN
+        INSERT OR IGNORE INTO analytics_dirty (keyval) VALUES (new.keyval);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analytics_history_ai AFTER INSERT ON status_history BEGIN
+        INSERT OR IGNORE INTO analytics_dirty (keyval) VALUES (new.keyval);
+    END
+    ''')
+    # History compaction can move an application's first decided transition
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analytics_history_ad AFTER DELETE ON status_history BEGIN
+        INSERT OR IGNORE INTO analytics_dirty (keyval) VALUES (old.keyval);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analytics_history_au AFTER UPDATE ON status_history BEGIN
+        INSERT OR IGNORE INTO analytics_dirty (keyval) VALUES (new.keyval);
+    END
+    ''')
+
+    if not existed:
+        print("Migrating: Building decision-time analytics...")
+        import analytics
+        analytics.rebuild(cursor.connection)
+
+# Source-of-truth tables (-> key column): the only ones in snapshots and change logs
+# (snapshots.py). Everything else (FTS, R*Tree, stats, clusters, analytics) is rebuilt from them.
+BASE_TABLES = {
+    'applications': 'keyval',
+    'status_history': 'id',
+    'scrape_queue': 'keyval',
+    'sync_state': 'key',
+    'agents': 'id',
+    'agent_aliases': 'alias',
+    'export_state': 'keyval',
+}
+
+def init_change_log(cursor):
+    """
+    change_log: the key of every BASE_TABLES row inserted, updated or deleted since the
+    last snapshots.export(), which writes those rows' current state as a delta file.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        key -- no affinity: keeps the key's own type
+    )
+    ''')
+    for table, key in BASE_TABLES.items():
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS change_log_{table}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO change_log (tbl, key) VALUES ('{table}', new.{key});
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS change_log_{table}_au AFTER UPDATE ON {table} BEGIN
+            INSERT INTO change_log (tbl, key) SELECT '{table}', old.{key} WHERE old.{key} IS NOT new.{key};
+            INSERT INTO change_log (tbl, key) VALUES ('{table}', new.{key});
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS change_log_{table}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO change_log (tbl, key) VALUES ('{table}', old.{key});
+        END
+        ''')
+
+def init_db(db_name=None):
+    if db_name is None and not os.path.exists(DB_NAME):
+        # Fresh checkout: the DB is not in git, rebuild it from the committed snapshot + deltas
+        import snapshots
+        snapshots.restore()
+    conn = get_db_connection(db_name)
     cursor = conn.cursor()
     
     # Enable Write Ahead Logging for concurrency (API writing, User reading)
@@ -18,7 +611,7 @@ def init_db():
     
     # Applications Table
     # keyval is the unique ID used by Idox (e.g., 'T6ZSXXSJI5I00')
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE IF NOT EXISTS applications (
         keyval TEXT PRIMARY KEY,
         reference TEXT,
@@ -29,6 +622,7 @@ def init_db():
         validated_date DATE, -- Missing column fixed
         decision_date DATE,
         agent_name TEXT,
+        agent_id INTEGER, -- agents.id (normalized agent_name, see agents.py)
         latitude REAL,
         longitude REAL,
         url TEXT,
@@ -39,7 +633,14 @@ def init_db():
         last_scraped_details TIMESTAMP, -- When we visited Idox
         needs_scrape BOOLEAN DEFAULT 1, -- Priority flag for scraper
         portal_keyval TEXT, -- Alternate key for scraping
-        validation_warning TEXT -- Warning validation messages
+        validation_warning TEXT, -- Warning validation messages
+        source_hash TEXT, -- Fingerprint of the open-data fields (change detection)
+        portal_status TEXT, -- Status label last shown by the portal's search ('Decided'); status keeps the feed code
+        
+        -- Display dates (DD/MM/YYYY), derived from the canonical ISO dates
+        received_date_fmt TEXT GENERATED ALWAYS AS ({display_date_sql('received_date')}) VIRTUAL,
+        validated_date_fmt TEXT GENERATED ALWAYS AS ({display_date_sql('validated_date')}) VIRTUAL,
+        decision_date_fmt TEXT GENERATED ALWAYS AS ({display_date_sql('decision_date')}) VIRTUAL
     )
     ''')
     
@@ -54,15 +655,61 @@ def init_db():
     )
     ''')
     
+    # Sync State Table (checkpoints / watermarks, key -> value)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP
+    )
+    ''')
+    
+    # Scrape Queue (persistent priority queue for the enricher, see scrape_queue.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS scrape_queue (
+        keyval TEXT PRIMARY KEY,
+        priority INTEGER NOT NULL DEFAULT 0, -- new > status change > data gap > stale
+        reason TEXT,
+        state TEXT NOT NULL DEFAULT 'pending', -- pending | done | dead
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP, -- backoff: not retried before this
+        last_error TEXT,
+        enqueued_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )
+    ''')
+    
+    # Export State (what gh_pages_generator last wrote for each record: shard + fingerprint)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS export_state (
+        keyval TEXT PRIMARY KEY,
+        shard TEXT NOT NULL,
+        fingerprint TEXT NOT NULL
+    )
+    ''')
+
     # Index for fast searching/filtering
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON applications(status);')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON applications(received_date);')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_needs_scrape ON applications(needs_scrape);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_queue_due ON scrape_queue(state, priority, next_attempt_at);')
+    # One application's history in order (/api/application, analytics) and time ranges (history.archive)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_status_history_keyval_date ON status_history(keyval, change_date);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_status_history_change_date ON status_history(change_date);')
+    
+    # Composite indexes for the /api/data sort + filter combinations (keyval = keyset tie-breaker)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_received_keyval ON applications(received_date, keyval);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_validated_keyval ON applications(validated_date, keyval);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_decided_keyval ON applications(decision_date, keyval);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_status_received ON applications(status, received_date, keyval);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_status_validated ON applications(status, validated_date, keyval);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_status_decided ON applications(status, decision_date, keyval);')
     
     # ---------------------------------------------------------
     # MIGRATION: Check for missing columns (Self-healing schema)
     # ---------------------------------------------------------
-    cursor.execute("PRAGMA table_info(applications)")
+    # table_xinfo also lists generated columns
+    cursor.execute("PRAGMA table_xinfo(applications)")
     columns = [r['name'] for r in cursor.fetchall()]
     
     if 'validated_date' not in columns:
@@ -86,9 +733,59 @@ def init_db():
         except Exception as e:
            print(f"Migration error: {e}")
 
+    if 'source_hash' not in columns:
+        print("Migrating: Adding 'source_hash' column...")
+        try:
+            cursor.execute("ALTER TABLE applications ADD COLUMN source_hash TEXT")
+        except Exception as e:
+           print(f"Migration error: {e}")
+
+    if 'portal_status' not in columns:
+        print("Migrating: Adding 'portal_status' column...")
+        try:
+            cursor.execute("ALTER TABLE applications ADD COLUMN portal_status TEXT")
+            # Live sync used to write portal labels into status: move them over, put back the
+            # code they replaced, and clear source_hash so the next feed sync rewrites the row
+            moved = cursor.execute("""
+                UPDATE applications SET
+                    portal_status = status,
+                    status = coalesce((SELECT h.old_status FROM status_history h
+                                       WHERE h.keyval = applications.keyval AND h.new_status = applications.status
+                                       ORDER BY h.change_date DESC, h.id DESC LIMIT 1), status),
+                    source_hash = NULL
+                WHERE status GLOB '*[^A-Z0-9]*' AND status != 'Unknown'
+            """).rowcount
+            if moved:
+                print(f"Migrating: Moved {moved} portal status labels to 'portal_status'.")
+        except Exception as e:
+           print(f"Migration error: {e}")
+
+    # Display columns (virtual, computed by SQLite on read) for DBs created before them
+    for col in DATE_COLUMNS:
+        if f'{col}_fmt' not in columns:
+            print(f"Migrating: Adding '{col}_fmt' display column...")
+            try:
+                cursor.execute(f"ALTER TABLE applications ADD COLUMN {col}_fmt TEXT "
+                               f"GENERATED ALWAYS AS ({display_date_sql(col)}) VIRTUAL")
+            except Exception as e:
+                print(f"Migration error: {e}")
+
+    # One-off repair: rewrite legacy date formats ('2025/02/28', '28/02/2025', ...) as ISO
+    repaired = repair_dates(cursor)
+    if repaired:
+        print(f"Migrating: Normalized {repaired} legacy date values to ISO.")
+
+    init_search_index(cursor)
+    init_spatial_index(cursor)
+    init_agents(cursor)
+    init_agent_stats(cursor)
+    init_cluster_index(cursor)
+    init_analytics(cursor)
+    init_change_log(cursor)
+
     conn.commit()
     conn.close()
-    print(f"Database {DB_NAME} initialized/verified successfully.")
+    print(f"Database {db_name or DB_NAME} initialized/verified successfully.")
 
 if __name__ == "__main__":
     init_db()
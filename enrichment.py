@@ -0,0 +1,144 @@
+"""
+Concurrent enrichment of applications with details scraped from the Idox portal.
+
+A bounded pool of worker threads scrapes several applications at once, but every
+HTTP request goes through one shared RateLimiter so the pool as a whole stays
+under a fixed requests-per-second budget. Workers never touch the database:
+results come back to the calling thread, which is the single writer and applies
+them in batches with executemany.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import agents
+import scrape_queue
+import scraper
+
+# Defaults (override with env vars or the sync_manager CLI)
+DEFAULT_WORKERS = int(os.environ.get('SCRAPE_WORKERS', 4))
+DEFAULT_RATE = float(os.environ.get('SCRAPE_RATE', 2.0))  # requests/second, all workers combined
+WRITE_BATCH_SIZE = 25
+
+UPDATE_SQL = """
+    UPDATE applications SET
+    address = COALESCE(?, address),
+    agent_name = COALESCE(?, agent_name),
+    agent_id = CASE WHEN ? IS NULL THEN agent_id ELSE ? END, -- follows agent_name
+    decision_date = COALESCE(?, decision_date),
+    portal_keyval = COALESCE(?, portal_keyval),
+    last_scraped_details = ?,
+    needs_scrape = 0
+    WHERE keyval = ?
+"""
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: wait() blocks until the caller may issue one request.
+    `rate` is requests per second shared by every thread using the limiter.
+    """
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.burst = max(1, burst)
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # Unused capacity accumulates up to `burst` requests
+            slot = max(self.next_slot, now - (self.burst - 1) * self.interval)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+def update_params(keyval, details, agent_id=None):
+    """
+    Maps a successful scrape result onto UPDATE_SQL parameters (None keeps the stored value).
+    agent_id: the normalized agent (agents.resolve), resolved by the writing thread.
+    """
+    # Decision Date: Convert dd/mm/yy -> YYYY-MM-DD
+    db_date = None
+    if details.get('decision_date'):
+        try:
+            db_date = datetime.strptime(details['decision_date'], '%d/%m/%y').strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+
+    return (
+        details.get('address') or None,
+        details.get('agent') or None,
+        details.get('agent') or None,
+        agent_id,
+        db_date,
+        details.get('portal_keyval') or None,
+        datetime.now(),
+        keyval
+    )
+
+def enrich_applications(conn, rows, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, batch_size=WRITE_BATCH_SIZE):
+    """
+    Scrapes `rows` (keyval, reference) concurrently and writes results through `conn`.
+    Successes are marked done in the scrape queue; failures keep needs_scrape = 1
+    and are rescheduled with backoff (scrape_queue.mark_failed).
+    Returns a summary dict (scraped, failed, elapsed_s, apps_per_min).
+    """
+    limiter = RateLimiter(rate, burst=workers)
+    started = time.perf_counter()
+    pending = []
+    failures = []
+    scraped = failed = 0
+
+    def flush():
+        if pending or failures:
+            try:
+                with conn:
+                    conn.executemany(UPDATE_SQL, pending)
+                    scrape_queue.mark_done(conn, [p[-1] for p in pending])
+                    scrape_queue.mark_failed(conn, failures)
+            except Exception:
+                # Rolled back, including agents resolved for this batch: drop them from the cache
+                agents.index.reset()
+                raise
+            pending.clear()
+            failures.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(scraper.scrape_application_details, r['keyval'], r['reference'], limiter.wait): r['keyval']
+            for r in rows
+        }
+        for future in as_completed(futures):
+            kv = futures[future]
+            try:
+                details = future.result()
+            except Exception as e:
+                print(f"Scrape worker error {kv}: {e}")
+                failures.append((kv, e))
+                failed += 1
+                continue
+
+            if details['success']:
+                pending.append(update_params(kv, details, agents.resolve(conn, details.get('agent'))))
+                scraped += 1
+                print(f"Updated {kv}: Addr={bool(details['address'])}, Agent={bool(details['agent'])}")
+            else:
+                print(f"Scrape failed for {kv}: {details.get('error')}")
+                failures.append((kv, details.get('error')))
+                failed += 1
+
+            if len(pending) + len(failures) >= batch_size:
+                flush()
+    flush()
+
+    elapsed = time.perf_counter() - started
+    done = scraped + failed
+    apps_per_min = done / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"Enrichment: {scraped} updated, {failed} failed in {elapsed:.1f}s "
+          f"({apps_per_min:.1f} apps/min, {workers} workers @ {rate:g} req/s)")
+    return {'scraped': scraped, 'failed': failed, 'elapsed_s': elapsed, 'apps_per_min': apps_per_min}
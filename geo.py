@@ -0,0 +1,128 @@
+"""
+Location filters for /api/data on top of the applications_geo R*Tree (database.init_spatial_index).
+
+The R*Tree finds candidate rows for a bounding box without scanning the table; exact
+tests then run on the stored latitude / longitude. The R*Tree only pays off for boxes
+covering a small part of the data: a box holding every point (a whole-city map view)
+becomes "has coordinates" (partial index idx_located_status), and a box covering more
+than INDEX_MAX_FRACTION of the points' extent is answered with a range scan instead.
+The extent is one aggregate over the R*Tree, cached per connection until the DB changes.
+
+Distances use the equirectangular approximation (metres, error well under 1% at city
+scale): plain arithmetic SQLite can evaluate, compared squared so no sqrt is needed in SQL.
+"""
+import math
+import threading
+import weakref
+
+import database
+
+M_PER_DEG_LAT = 111195.0 # mean Earth radius * pi / 180
+MAX_RADIUS_M = 50000 # radius / nearest searches never look further than this
+NEAREST_START_M = 250 # first box half-size tried by nearest_radius()
+MAX_NEAREST = 500
+INDEX_MAX_FRACTION = 0.25 # share of the points' extent; larger boxes skip the R*Tree
+LOCATED = "applications.latitude IS NOT NULL AND applications.longitude IS NOT NULL"
+
+_extents = weakref.WeakKeyDictionary() # connection -> (change token, extent)
+_extents_lock = threading.Lock()
+
+def parse_bbox(text):
+    """'west,south,east,north' (lon/lat, GeoJSON order) -> (min_lon, min_lat, max_lon, max_lat), None if invalid."""
+    try:
+        west, south, east, north = (float(v) for v in text.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        return None
+    return west, south, east, north
+
+def box_around(lat, lon, radius_m):
+    """Bounding box (min_lon, min_lat, max_lon, max_lat) enclosing the circle of radius_m around a point."""
+    dlat = radius_m / M_PER_DEG_LAT
+    dlon = radius_m / (M_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+    return lon - dlon, lat - dlat, lon + dlon, lat + dlat
+
+def extent(conn):
+    """
+    (min_lon, min_lat, max_lon, max_lat) of every point in the R*Tree, None when the index
+    is missing or empty. The aggregate reads the whole index, so it is cached per connection
+    and recomputed once PRAGMA data_version (commits by other connections) or the
+    connection's own total_changes moves. Connections not opened by database.connect
+    can't be cached and are asked every time.
+    """
+    if not database.has_spatial_index(conn):
+        return None
+    token = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    try:
+        with _extents_lock:
+            cached = _extents.get(conn)
+    except TypeError:
+        cached = None
+    if cached and cached[0] == token:
+        return cached[1]
+    row = conn.execute("SELECT min(min_lon), min(min_lat), max(max_lon), max(max_lat) FROM applications_geo").fetchone()
+    box = tuple(row) if row[0] is not None else None
+    try:
+        with _extents_lock:
+            _extents[conn] = (token, box)
+    except TypeError:
+        pass
+    return box
+
+def overlap_fraction(bbox, cell):
+    """Share of cell's area covered by bbox (a degenerate cell counts as 0 or 1)."""
+    w = min(bbox[2], cell[2]) - max(bbox[0], cell[0])
+    h = min(bbox[3], cell[3]) - max(bbox[1], cell[1])
+    if w < 0 or h < 0:
+        return 0.0
+    area = (cell[2] - cell[0]) * (cell[3] - cell[1])
+    return min(1.0, w * h / area) if area > 0 else 1.0
+
+def bbox_clause(conn, bbox, box=None):
+    """
+    SQL predicate (+ params) for applications inside bbox: R*Tree candidates for selective
+    boxes, then the exact test (the R*Tree stores 32-bit floats rounded outwards).
+    The share of points in the box is estimated as its share of the points' extent
+    (`box`: extent(conn), for callers asking many times while they write other tables).
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    box = box or extent(conn)
+    if box and min_lon <= box[0] and min_lat <= box[1] and max_lon >= box[2] and max_lat >= box[3]:
+        return LOCATED, []
+    sql = "applications.latitude BETWEEN ? AND ? AND applications.longitude BETWEEN ? AND ?"
+    params = [min_lat, max_lat, min_lon, max_lon]
+    if box and overlap_fraction(bbox, box) <= INDEX_MAX_FRACTION:
+        sql = ("applications.rowid IN (SELECT id FROM applications_geo "
+               "WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?) AND " + sql)
+        params = [min_lat, max_lat, min_lon, max_lon] + params
+    return sql, params
+
+def distance2_sql(lat, lon):
+    """SQL expression (+ params) for the squared distance in m^2 from (lat, lon)."""
+    ky = M_PER_DEG_LAT
+    kx = M_PER_DEG_LAT * math.cos(math.radians(lat))
+    sql = ("((applications.latitude - ?) * ?) * ((applications.latitude - ?) * ?)"
+           " + ((applications.longitude - ?) * ?) * ((applications.longitude - ?) * ?)")
+    return sql, [lat, ky, lat, ky, lon, kx, lon, kx]
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Same approximation as distance2_sql, in metres (None if a coordinate is missing)."""
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    dy = (lat2 - lat1) * M_PER_DEG_LAT
+    dx = (lon2 - lon1) * M_PER_DEG_LAT * math.cos(math.radians(lat1))
+    return math.hypot(dx, dy)
+
+def nearest_radius(count_in_box, lat, lon, n):
+    """
+    Radius that is guaranteed to contain the n nearest matches: grows a square box
+    (doubling its half-size) until count_in_box(bbox) >= n, then takes the circle
+    circumscribing that box. Returns MAX_RADIUS_M if there are fewer than n in range.
+    """
+    half = NEAREST_START_M
+    while half * math.sqrt(2) < MAX_RADIUS_M:
+        if count_in_box(box_around(lat, lon, half)) >= n:
+            return half * math.sqrt(2)
+        half *= 2
+    return MAX_RADIUS_M
@@ -1,90 +1,315 @@
-import sqlite3
+import argparse
+import gzip
+import hashlib
 import json
 import os
+import re
 from datetime import datetime
+import clusters
+import database
 
-DB_NAME = "construction_intelligence.db"
+try:
+    import brotli  # optional: .br variants are skipped without it
+except ImportError:
+    brotli = None
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+OUTPUT_DIR = 'data'
+SHARD_DIR = os.path.join(OUTPUT_DIR, 'shards')
+SEARCH_DIR = os.path.join(OUTPUT_DIR, 'search')
+CLUSTER_DIR = os.path.join(OUTPUT_DIR, 'clusters')
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, 'manifest.json')
+FORMAT_VERSION = 1
 
-def run():
+# Shard rows are arrays in this column order (names listed once, in the manifest).
+# Display dates and the portal URL are derived in the browser.
+EXPORT_COLUMNS = [
+    'keyval', 'ref', 'status', 'proposal', 'received_date', 'validated_date', 'decision_date',
+    'address', 'agent', 'lat', 'lon', 'needs_scrape', 'portal_keyval', 'validation_warning'
+]
+
+# Search index: the browser's tokenizer (index.html, tokenize()) must match this one
+SEARCH_FIELDS = ['ref', 'keyval', 'proposal', 'address']
+MIN_TOKEN_LENGTH = 2
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def shard_key(received_date):
+    """Records are partitioned by received month ('YYYY-MM'); undated ones share one shard."""
+    return received_date[:7] if received_date else 'undated'
+
+def encode_shard(rows):
+    """Compact, deterministic JSON bytes for one shard (same rows -> same bytes -> same hash)."""
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def content_hash(payload):
+    return hashlib.sha256(payload).hexdigest()[:12]
+
+def write_file(directory, stem, payload):
+    """
+    Writes <directory>/<stem>.<hash>.json plus precompressed .gz (and .br when available).
+    The content hash is in the file name, so a URL never changes content and
+    can be cached forever by the browser / CDN. Returns the manifest entry.
+    """
+    digest = content_hash(payload)
+    name = f"{stem}.{digest}.json"
+    path = os.path.join(directory, name)
+    variants = {'json': payload, 'gz': gzip.compress(payload, 9, mtime=0)}
+    if brotli:
+        variants['br'] = brotli.compress(payload)
+
+    with open(path, 'wb') as f:
+        f.write(variants['json'])
+    for ext in ('gz', 'br'):
+        if ext in variants:
+            with open(f"{path}.{ext}", 'wb') as f:
+                f.write(variants[ext])
+
+    return {
+        'file': f"{os.path.basename(directory)}/{name}",
+        'hash': digest,
+        'bytes': {ext: len(data) for ext, data in variants.items()}
+    }
+
+def remove_stale_files(keep):
+    """Deletes shard / search index / cluster files no longer referenced by the manifest."""
+    for directory in (SHARD_DIR, SEARCH_DIR, CLUSTER_DIR):
+        for name in os.listdir(directory):
+            base = name[:-3] if name.endswith(('.gz', '.br')) else name
+            if f"{os.path.basename(directory)}/{base}" not in keep:
+                os.remove(os.path.join(directory, name))
+
+def load_manifest():
+    """The manifest from the previous export, or None if missing / unreadable / other format."""
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != FORMAT_VERSION or manifest.get('columns') != EXPORT_COLUMNS:
+        return None
+    return manifest
+
+def files_exist(entry):
+    path = os.path.join(OUTPUT_DIR, entry['file'])
+    return all(os.path.exists(path if ext == 'json' else f"{path}.{ext}") for ext in entry['bytes'])
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) >= MIN_TOKEN_LENGTH]
+
+def build_search_index(records):
+    """
+    Inverted index over SEARCH_FIELDS. Record ids are positions in export order
+    (shards in manifest order, rows in shard order), i.e. indexes into the browser's allData.
+    Tokens are sorted so the browser can prefix-match with a binary search;
+    each posting list is ascending ids, delta-encoded to keep the file small.
+    """
+    fields = [EXPORT_COLUMNS.index(c) for c in SEARCH_FIELDS]
+    postings = {}
+    for rid, values in enumerate(records):
+        for token in set(tokenize(' '.join(str(values[i] or '') for i in fields))):
+            postings.setdefault(token, []).append(rid)
+
+    tokens = sorted(postings)
+    encoded = []
+    for token in tokens:
+        ids = postings[token]
+        encoded.append([ids[0]] + [b - a for a, b in zip(ids, ids[1:])])
+    return {'tokens': tokens, 'postings': encoded}
+
+def build_facets(records, top_agents):
+    """Record counts per status and per (top) agent for the stat tiles and the agent list."""
+    status_i, agent_i = EXPORT_COLUMNS.index('status'), EXPORT_COLUMNS.index('agent')
+    status, agent = {}, {}
+    wanted = set(top_agents)
+    for values in records:
+        status[values[status_i]] = status.get(values[status_i], 0) + 1
+        if values[agent_i] in wanted:
+            agent[values[agent_i]] = agent.get(values[agent_i], 0) + 1
+    return {'status': dict(sorted(status.items())), 'agent': {a: agent[a] for a in top_agents}}
+
+def record_fingerprint(values):
+    return hashlib.sha1(encode_shard(values)).hexdigest()[:16]
+
+def dirty_shards(current, previous):
+    """
+    Shard keys touched since the last export: new or changed records dirty their shard,
+    records that moved month or disappeared also dirty the shard they were in.
+    `current` / `previous`: keyval -> (shard, fingerprint).
+    """
+    dirty = set()
+    for kv, state in current.items():
+        before = previous.get(kv)
+        if before != state:
+            dirty.add(state[0])
+            if before:
+                dirty.add(before[0])
+    for kv, (shard, _) in previous.items():
+        if kv not in current:
+            dirty.add(shard)
+    return dirty
+
+def save_export_state(conn, current, previous):
+    """Brings export_state in line with what was just exported (changed rows only)."""
+    with conn:
+        conn.executemany("DELETE FROM export_state WHERE keyval = ?",
+                         [(kv,) for kv in previous if kv not in current])
+        conn.executemany(
+            "INSERT INTO export_state (keyval, shard, fingerprint) VALUES (?, ?, ?) "
+            "ON CONFLICT(keyval) DO UPDATE SET shard = excluded.shard, fingerprint = excluded.fingerprint",
+            [(kv, shard, fp) for kv, (shard, fp) in current.items() if previous.get(kv) != (shard, fp)]
+        )
+
+def run(full=False):
+    """
+    Incremental export: only shards containing records that changed since the last run
+    (per-record fingerprints in export_state) are rebuilt, and nothing at all is written
+    when the output would be identical, so the workflow's `git diff --staged --quiet`
+    sees no change. full=True rebuilds every shard (files are still only rewritten if
+    their content changed).
+    """
     print("Generating static data for GitHub Pages...")
-    
-    conn = get_db_connection()
+
+    # The only writes: bring agent_stats / map clusters current here, export_state at the end.
+    # Everything is read through a read-only connection.
+    writer = database.get_db_connection()
+    with writer:
+        database.refresh_agent_stats(writer)
+        clusters.refresh(writer)
+    conn = database.connect(readonly=True)
     cursor = conn.cursor()
-    
+
     # 1. Fetch All Applications
-    # We fetch EVERYTHING so the frontend can filter/sort freely.
-    # Be mindful of size. If > 10MB, might be slow on mobile.
+    # We fetch EVERYTHING so the frontend can filter/sort freely,
+    # but it is split into monthly shards so first paint only needs the newest one.
     print("Fetching applications...")
-    rows = cursor.execute("SELECT * FROM applications ORDER BY received_date DESC").fetchall()
-    
-    apps = []
-    agent_counts = {}
-    
+    # Agents are exported under their normalized display name, so every spelling groups together
+    rows = cursor.execute("""
+        SELECT a.*, ag.name AS agent_display FROM applications a LEFT JOIN agents ag ON ag.id = a.agent_id
+        ORDER BY a.received_date DESC, a.keyval
+    """).fetchall()
+
+    shards = {}
+    current = {}
+
     for row in rows:
-        # Format Date Helper
-        def fmt_date(d_str):
-            if not d_str: return '-'
-            s = str(d_str).strip()
-            if not s or s == 'None': return '-'
-            try:
-                # DB format is YYYY-MM-DD
-                dt = datetime.strptime(s, '%Y-%m-%d')
-                return dt.strftime('%d/%m/%Y')
-            except:
-                return s
-
-        # Agent Count Logic
-        agent = row['agent_name']
-        if agent and agent != 'Independent':
-            agent_counts[agent] = agent_counts.get(agent, 0) + 1
-            
-        # URL Construction
-        active_keyval = row['portal_keyval'] if row['portal_keyval'] else row['keyval']
-        council_url = f"https://planningaccess.york.gov.uk/online-applications/applicationDetails.do?activeTab=summary&keyVal={active_keyval}"
-
-        apps.append({
-            'keyval': row['keyval'],
-            'ref': row['reference'] or row['keyval'],
-            'status': row['status'] or 'Unknown',
-            'proposal': row['proposal'] or '',
-            'received_date': row['received_date'], # Keep raw for sorting
-            'validated_date': row['validated_date'],
-            'decision_date': row['decision_date'],
-            'received_date_fmt': fmt_date(row['received_date']),
-            'validated_date_fmt': fmt_date(row['validated_date']),
-            'decision_date_fmt': fmt_date(row['decision_date']),
-            'address': row['address'] or 'Address not available',
-            'agent': row['agent_name'] or '-',
-            'lat': row['latitude'],
-            'lon': row['longitude'],
-            'needs_scrape': row['needs_scrape'],
-            'council_url': council_url,
-            'validation_warning': row['validation_warning']
-        })
-        
-    conn.close()
-    
-    # 2. Process Agents (Top 50)
-    sorted_agents = sorted(agent_counts.items(), key=lambda item: item[1], reverse=True)
-    top_agents = [x[0] for x in sorted_agents[:100]] # Top 100 for static
-    
-    # 3. Compile Data
-    final_data = {
-        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'applications': apps,
-        'agents': top_agents
+        values = [
+            row['keyval'],
+            row['reference'] or row['keyval'],
+            row['status'] or 'Unknown',
+            row['proposal'] or '',
+            row['received_date'], # ISO, keep raw for sorting
+            row['validated_date'],
+            row['decision_date'],
+            row['address'] or 'Address not available',
+            row['agent_display'] or row['agent_name'] or '-',
+            row['latitude'],
+            row['longitude'],
+            row['needs_scrape'],
+            row['portal_keyval'],
+            row['validation_warning']
+        ]
+        key = shard_key(row['received_date'])
+        shards.setdefault(key, []).append(values)
+        current[row['keyval']] = (key, record_fingerprint(values))
+
+    # 2. Process Agents (Top 100 for static), from the maintained agent_stats table
+    top_agents = [r['name'] for r in cursor.execute("""
+        SELECT ag.name FROM agent_stats s JOIN agents ag ON ag.id = s.agent_id
+        WHERE ag.canonical != 'independent'
+        ORDER BY s.applications DESC, ag.name LIMIT 100
+    """)]
+
+    # 3. Work out which shards changed since the last export
+    previous = {r['keyval']: (r['shard'], r['fingerprint'])
+                for r in cursor.execute("SELECT keyval, shard, fingerprint FROM export_state")}
+    manifest = load_manifest()
+    old_entries = {e['key']: e for e in manifest['shards']} if manifest else {}
+
+    dirty = set(shards) if full else dirty_shards(current, previous)
+    # Anything missing from the previous output is rebuilt regardless of the state table
+    dirty |= {k for k in shards if k not in old_entries or not files_exist(old_entries[k])}
+
+    # 4. Write Shards (newest first; 'undated' sorts last)
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    os.makedirs(SEARCH_DIR, exist_ok=True)
+    entries = []
+    bytes_written = rebuilt = 0
+    for key in sorted(shards, key=lambda k: (k != 'undated', k), reverse=True):
+        old = old_entries.get(key)
+        if key in dirty:
+            payload = encode_shard(shards[key])
+            if old and old['hash'] == content_hash(payload) and files_exist(old):
+                entries.append(old) # Same content after all (e.g. a change that was reverted)
+                continue
+            entry = {'key': key, **write_file(SHARD_DIR, key, payload), 'count': len(shards[key])}
+            bytes_written += sum(entry['bytes'].values())
+            rebuilt += 1
+            entries.append(entry)
+        else:
+            entries.append(old)
+
+    # 5. Search Index + Facets over all records (ids = position in manifest shard order)
+    records = [values for e in entries for values in shards[e['key']]]
+    facets = build_facets(records, top_agents)
+    search = manifest.get('search') if manifest else None
+    shards_changed = not manifest or [e['hash'] for e in entries] != [e['hash'] for e in manifest['shards']]
+    if shards_changed or not search or not files_exist(search):
+        payload = encode_shard(build_search_index(records))
+        if not (search and search['hash'] == content_hash(payload) and files_exist(search)):
+            search = write_file(SEARCH_DIR, 'search', payload)
+            bytes_written += sum(search['bytes'].values())
+            rebuilt += 1
+
+    # 6. Map clusters: one file per cluster level, so the map downloads cell counts instead of every point
+    os.makedirs(CLUSTER_DIR, exist_ok=True)
+    old_levels = manifest.get('clusters', {}).get('levels', {}) if manifest else {}
+    levels = {}
+    for level in range(clusters.MIN_LEVEL, clusters.MAX_LEVEL + 1):
+        payload = encode_shard(clusters.cells(conn, level))
+        old = old_levels.get(str(level))
+        if old and old['hash'] == content_hash(payload) and files_exist(old):
+            levels[str(level)] = old
+            continue
+        levels[str(level)] = {**write_file(CLUSTER_DIR, f"z{level}", payload), 'level': level}
+        bytes_written += sum(levels[str(level)]['bytes'].values())
+        rebuilt += 1
+
+    # 7. Write Manifest, only if something in it changed (generated_at alone doesn't count)
+    body = {
+        'version': FORMAT_VERSION,
+        'total': len(rows),
+        'columns': EXPORT_COLUMNS,
+        'agents': top_agents,
+        'facets': facets,
+        'search': search,
+        'clusters': {'zoom_offset': clusters.ZOOM_OFFSET, 'columns': clusters.COLUMNS, 'levels': levels},
+        'shards': entries
     }
-    
-    # 4. Write to file
-    with open('data.json', 'w', encoding='utf-8') as f:
-        json.dump(final_data, f)
-        
-    print(f"Success! Generated data.json with {len(apps)} records.")
+    manifest_changed = manifest is None or {k: v for k, v in manifest.items() if k != 'generated_at'} != body
+    if manifest_changed:
+        manifest = {'version': FORMAT_VERSION,
+                    'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **body}
+        encoded = json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        with open(MANIFEST_PATH, 'wb') as f:
+            f.write(encoded)
+        bytes_written += len(encoded)
+        remove_stale_files({e['file'] for e in entries} | {search['file']} | {e['file'] for e in levels.values()})
+
+    # 8. Remember what was exported
+    conn.close()
+    save_export_state(writer, current, previous)
+    writer.close()
+
+    changed = manifest_changed or rebuilt > 0
+    if changed:
+        print(f"Success! Exported {len(rows)} records: rewrote {rebuilt} of {len(entries) + len(levels) + 1} files (shards + search index + clusters), "
+              f"{bytes_written / 1024:.1f} KB written to {OUTPUT_DIR}/.")
+    else:
+        print(f"No changes since the last export ({len(rows)} records, {len(entries)} shards). Nothing written.")
+    return {'records': len(rows), 'shards': len(entries), 'rebuilt': rebuilt,
+            'bytes_written': bytes_written, 'changed': changed}
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Export the database as static data for GitHub Pages.")
+    parser.add_argument('--full', action='store_true', help="Rebuild every shard, ignoring the export state")
+    args = parser.parse_args()
+    run(full=args.full)
@@ -0,0 +1,158 @@
+"""
+status_history maintenance: compaction of redundant transitions and archival of old
+rows into a separate, attached database (database.history_archive_path), so the main
+DB only carries recent history.
+
+Redundant transitions come from the two status sources disagreeing: the CSV feed uses
+codes ('PDE', 'PER'), live_search the portal's labels ('Decided'), so one decision can
+log PDE -> Decided -> PER. compact() rewrites each application's history, in order,
+dropping:
+  1. no-op rows (old and new status equal, ignoring case / spacing)
+  2. exact repeats of the previous row
+and merging A -> <label> -> B within FLAP_WINDOW into one A -> B row at the first
+timestamp (when the decision was first seen). Only applications with rows added since
+the last compaction are looked at.
+
+Round trips A -> B -> A (a status the portal published, then took back) are real
+transitions and stay in the table; without_bounces() hides them when history is shown.
+"""
+import argparse
+import re
+from datetime import datetime, timedelta
+
+import database
+
+FLAP_WINDOW = timedelta(hours=36)
+ARCHIVE_AFTER_DAYS = 365
+COMPACTED_THROUGH = 'history_compacted_through_id' # sync_state key: last status_history id compacted
+CODE_RE = re.compile(r'^[A-Z0-9]+$') # feed status codes; anything else is a portal label
+
+def _same(a, b):
+    return (a or '').strip().upper() == (b or '').strip().upper()
+
+def _when(value):
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+def _close(a, b):
+    a, b = _when(a), _when(b)
+    return a is not None and b is not None and b - a <= FLAP_WINDOW
+
+def compact_rows(rows):
+    """
+    One application's history rows (id, old_status, new_status, change_date), oldest first
+    -> (ids to delete, {id: new new_status}) that make it non-redundant.
+    """
+    kept, deleted, updated = [], set(), {}
+    for id_, old, new, when in rows:
+        row = [id_, old, new, when]
+        prev = kept[-1] if kept else None
+        if _same(old, new):
+            deleted.add(id_)
+            continue
+        if prev and prev[1:] == row[1:]:
+            deleted.add(id_)
+            continue
+        if (prev and _same(prev[2], old) and not _same(prev[1], new) and _close(prev[3], when)
+                and not CODE_RE.match((prev[2] or '').strip())):
+            prev[2] = new
+            updated[prev[0]] = new
+            deleted.add(id_)
+            continue
+        kept.append(row)
+    return deleted, updated
+
+def compact(conn):
+    """
+    Compacts the history of every application with rows added since the last run
+    (caller commits). Returns counts: applications looked at, rows deleted, rows merged.
+    """
+    through = int(database.get_sync_state(conn, COMPACTED_THROUGH, 0))
+    latest = conn.execute("SELECT max(id) FROM status_history").fetchone()[0] or through
+    keyvals = [r[0] for r in conn.execute("SELECT DISTINCT keyval FROM status_history WHERE id > ?", (through,))]
+
+    deleted, updated = set(), {}
+    for keyval in keyvals:
+        rows = conn.execute("""
+            SELECT id, old_status, new_status, change_date FROM status_history
+            WHERE keyval = ? ORDER BY change_date, id
+        """, (keyval,)).fetchall()
+        d, u = compact_rows([tuple(r) for r in rows])
+        deleted |= d
+        updated.update(u)
+
+    conn.executemany("UPDATE status_history SET new_status = ? WHERE id = ?", [(v, k) for k, v in updated.items()])
+    conn.executemany("DELETE FROM status_history WHERE id = ?", [(i,) for i in deleted])
+    database.set_sync_state(conn, COMPACTED_THROUGH, latest)
+    return {'applications': len(keyvals), 'deleted': len(deleted), 'merged': len(updated)}
+
+def archive(conn, older_than_days=ARCHIVE_AFTER_DAYS, db_name=None):
+    """
+    Moves history rows older than `older_than_days` into the archive DB (created on first
+    use, ids kept) (caller commits). Attaching needs no open transaction, so run it before
+    other writes. Returns the number of rows moved.
+    """
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    if not conn.execute("SELECT 1 FROM main.status_history WHERE change_date < ? LIMIT 1", (cutoff,)).fetchone():
+        return 0
+
+    database.attach_history_archive(conn, db_name)
+    archive_db = database.HISTORY_ARCHIVE
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {archive_db}.status_history (
+            id INTEGER PRIMARY KEY,
+            keyval TEXT,
+            old_status TEXT,
+            new_status TEXT,
+            change_date TIMESTAMP
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {archive_db}.idx_status_history_keyval_date "
+                 f"ON status_history(keyval, change_date)")
+    moved = conn.execute(f"""
+        INSERT OR IGNORE INTO {archive_db}.status_history (id, keyval, old_status, new_status, change_date)
+        SELECT id, keyval, old_status, new_status, change_date FROM main.status_history WHERE change_date < ?
+    """, (cutoff,)).rowcount
+    conn.execute("DELETE FROM main.status_history WHERE change_date < ?", (cutoff,))
+    return moved
+
+def without_bounces(rows):
+    """
+    History rows (dicts, newest first) minus round trips A -> B -> A within FLAP_WINDOW:
+    both rows of the pair are left out, as the status ended where it started.
+    """
+    shown = []
+    for row in reversed(rows):
+        prev = shown[-1] if shown else None
+        if (prev and _same(prev['new_status'], row['old_status']) and _same(prev['old_status'], row['new_status'])
+                and _close(prev['change_date'], row['change_date'])):
+            shown.pop()
+            continue
+        shown.append(row)
+    return shown[::-1]
+
+def for_application(conn, keyval):
+    """Every history row of one application, live and archived, newest first."""
+    return conn.execute(f"""
+        SELECT * FROM {database.history_source(conn)} WHERE keyval = ? ORDER BY change_date DESC
+    """, (keyval,)).fetchall()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact and archive status_history.")
+    parser.add_argument('--archive-after', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="Move history older than this many days into the archive DB")
+    parser.add_argument('--full', action='store_true', help="Compact every application, not just recently changed ones")
+    args = parser.parse_args()
+    database.init_db()
+    conn = database.get_db_connection()
+    with conn:
+        moved = archive(conn, args.archive_after)
+    with conn:
+        if args.full:
+            database.set_sync_state(conn, COMPACTED_THROUGH, 0)
+        result = compact(conn)
+    conn.close()
+    print(f"History: compacted {result['applications']} applications ({result['deleted']} rows dropped, "
+          f"{result['merged']} merged), {moved} rows archived.")
@@ -0,0 +1,209 @@
+"""
+On-disk conditional-GET cache shared by the outbound HTTP callers
+(open-data CSV in sync_manager / planning_tracker, portal pages in scraper).
+
+One entry per URL (+ query params): the body in <key>.body, validators and
+bookkeeping in <key>.json. A request for a cached URL is
+  - answered from disk without any request while the entry is younger than `max_age`,
+  - otherwise revalidated with If-None-Match / If-Modified-Since; on 304 the stored
+    body is served, so an unchanged resource costs one empty response.
+Bodies are streamed to disk, never held in memory whole. prune() evicts entries
+unused for longer than TTL_SECONDS, then least recently used ones until the cache
+fits in MAX_BYTES. Counters in `stats` are shared by all threads.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', '.http_cache')
+TTL_SECONDS = int(os.environ.get('HTTP_CACHE_TTL', 14 * 24 * 3600))
+MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+CHUNK_SIZE = 1 << 16
+
+_lock = threading.Lock()
+stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'bytes_saved': 0, 'bytes_downloaded': 0}
+
+def _count(**deltas):
+    with _lock:
+        for key, value in deltas.items():
+            stats[key] += value
+
+def reset_stats():
+    with _lock:
+        for key in stats:
+            stats[key] = 0
+
+def summary():
+    with _lock:
+        s = dict(stats)
+    return (f"HTTP cache: {s['hits']} fresh hits, {s['revalidated']} revalidated (304), {s['misses']} downloads; "
+            f"{s['bytes_saved'] / 1e6:.2f} MB saved, {s['bytes_downloaded'] / 1e6:.2f} MB downloaded")
+
+def cache_key(url, params=None):
+    """Canonical URL (params encoded the way requests sends them) and its file-name key."""
+    full_url = requests.Request('GET', url, params=params).prepare().url
+    return full_url, hashlib.sha256(full_url.encode('utf-8')).hexdigest()
+
+class CachedResponse:
+    """
+    What get() returns. For 200s the body is a file in the cache (`path`) and is only
+    read when .content / .text / .json() / open() is used. `source` says where it came
+    from: 'network' (downloaded now), 'revalidated' (304) or 'cache' (fresh, no request).
+    """
+    def __init__(self, url, status_code, source, path=None, meta=None, content=None):
+        self.url = url
+        self.status_code = status_code
+        self.source = source
+        self.path = path
+        self.meta = meta or {}
+        self.encoding = self.meta.get('encoding')
+        self._content = content
+
+    @property
+    def changed(self):
+        """False when the body is the one we already had (304 or fresh hit)."""
+        return self.source == 'network'
+
+    @property
+    def version(self):
+        """The validator (ETag, else Last-Modified) identifying this body, if the server sent one."""
+        return self.meta.get('etag') or self.meta.get('last_modified')
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    @property
+    def content(self):
+        if self._content is None:
+            with self.open() as f:
+                self._content = f.read()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+def _paths(key):
+    return os.path.join(CACHE_DIR, f"{key}.body"), os.path.join(CACHE_DIR, f"{key}.json")
+
+def _load_meta(key):
+    body_path, meta_path = _paths(key)
+    if not os.path.exists(body_path):
+        return None
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_atomic(path, write):
+    """Writes through a temp file + rename, so readers in other threads never see half a file."""
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            result = write(f)
+        os.replace(tmp, path)
+        return result
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def _save_meta(key, meta):
+    _write_atomic(_paths(key)[1], lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+def get(session, url, params=None, headers=None, timeout=30, max_age=0, before_request=None):
+    """
+    Conditional GET through the cache. `max_age` (seconds) lets a stored body be reused
+    without any request; 0 always revalidates. `before_request` is called only when a
+    request is actually sent (e.g. a rate limiter). Only 200 responses are stored.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    full_url, key = cache_key(url, params)
+    body_path, _ = _paths(key)
+    meta = _load_meta(key)
+
+    if meta and max_age and time.time() - meta['stored_at'] < max_age:
+        os.utime(body_path) # mtime = last use, for LRU eviction
+        _count(hits=1, bytes_saved=meta['size'])
+        return CachedResponse(full_url, 200, 'cache', body_path, meta)
+
+    request_headers = dict(headers or {})
+    if meta:
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+
+    if before_request:
+        before_request()
+    with session.get(full_url, headers=request_headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and meta:
+            meta['stored_at'] = time.time()
+            _save_meta(key, meta)
+            os.utime(body_path)
+            _count(revalidated=1, bytes_saved=meta['size'])
+            return CachedResponse(full_url, 200, 'revalidated', body_path, meta)
+
+        if response.status_code != 200:
+            content = response.content
+            _count(misses=1, bytes_downloaded=len(content))
+            return CachedResponse(full_url, response.status_code, 'network',
+                                  meta={'encoding': response.encoding}, content=content)
+
+        def write_body(f):
+            size = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+            return size
+
+        size = _write_atomic(body_path, write_body)
+        meta = {
+            'url': full_url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'encoding': response.encoding,
+            'stored_at': time.time(),
+            'size': size
+        }
+        _save_meta(key, meta)
+        _count(misses=1, bytes_downloaded=size)
+        return CachedResponse(full_url, 200, 'network', body_path, meta)
+
+def prune(ttl=TTL_SECONDS, max_bytes=MAX_BYTES):
+    """Evicts entries unused for `ttl` seconds, then the least recently used beyond `max_bytes`."""
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    now = time.time()
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name.endswith('.tmp') and now - os.path.getmtime(path) > 3600:
+            os.remove(path) # left behind by an interrupted download
+        elif name.endswith('.body'):
+            entries.append((os.path.getmtime(path), os.path.getsize(path), name[:-5]))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for used, size, key in entries:
+        if now - used <= ttl and total <= max_bytes:
+            break
+        for path in _paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+        total -= size
+        removed += 1
+    return removed
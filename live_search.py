@@ -1,8 +1,9 @@
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import random
-import time
+import argparse
+import enrichment
+import portal_extract
 
 # Headers for requests (Matched to scraper.py to look consistent)
 HEADERS = {
@@ -12,169 +13,231 @@ HEADERS = {
     'Referer': 'https://planningaccess.york.gov.uk/online-applications/search.do?action=advanced'
 }
 
-def search_recent_decisions(days=7):
+BASE_URL = "https://planningaccess.york.gov.uk/online-applications"
+
+RESULTS_PER_PAGE = 100 # Idox maximum; cuts the number of result pages ~10x
+MAX_PAGES = 50 # safety stop per search
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 1.0 # requests/second across all searches
+
+def new_session(throttle):
     """
-    Searches for applications decided in the last N days.
+    Idox keeps the search criteria (and so the result paging) in the server-side
+    session, so every concurrent search gets its own session + cookie.
     """
-    print(f"Searching for decisions in the last {days} days...")
-    
     session = requests.Session()
-    
-    # Calculate Date Range
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
-    
-    start_str = start_date.strftime('%d/%m/%Y')
-    end_str = end_date.strftime('%d/%m/%Y')
-    
-    # Simple Search URL - Often easier than Advanced for "Received" or "Decided"
-    # But Advanced Search is better for date ranges.
-    
-    # 1. Get Session Cookie from Search Page First
     try:
-        session.get("https://planningaccess.york.gov.uk/online-applications/search.do?action=advanced", headers=HEADERS)
+        throttle()
+        session.get(f"{BASE_URL}/search.do?action=advanced", headers=HEADERS, timeout=30)
     except Exception as e:
         print(f"Failed to init session: {e}")
+    return session
+
+def fetch_all_pages(session, first_page, throttle):
+    """
+    All result items of the search held by `session`, starting from its first results page:
+    re-pages at RESULTS_PER_PAGE when there is more than one page (keeping the original
+    page 1 if the portal doesn't answer that with results), then follows
+    action=page&searchCriteria.page=N until the pager has no next link.
+    Logs when the items fall short of the portal's own result count.
+    """
+    items, next_href = portal_extract.extract_search_results(first_page)
+    total = portal_extract.result_total(first_page)
+    if not next_href:
+        return items
+
+    # Raise the page size (resultsPerPage form) and start again from page 1
+    throttle()
+    res = session.post(f"{BASE_URL}/pagedSearchResults.do", data={
+        'searchCriteria.page': 1, 'action': 'page', 'orderBy': 'DateReceived',
+        'orderByDirection': 'Descending', 'searchCriteria.resultsPerPage': RESULTS_PER_PAGE
+    }, headers=HEADERS, timeout=30)
+    repaged, repaged_next = portal_extract.extract_search_results(res.text)
+    if repaged:
+        items, next_href = repaged, repaged_next
+    else:
+        print("resultsPerPage not accepted; paging at the portal's default page size")
+
+    page = 1
+    while next_href and page < MAX_PAGES:
+        page += 1
+        throttle()
+        res = session.get(f"{BASE_URL}/pagedSearchResults.do", params={
+            'action': 'page', 'searchCriteria.page': page
+        }, headers=HEADERS, timeout=30)
+        batch, next_href = portal_extract.extract_search_results(res.text)
+        if not batch:
+            print(f"Result page {page} came back empty; stopping")
+            break
+        items.extend(batch)
+
+    if next_href and page >= MAX_PAGES:
+        print(f"Stopped after MAX_PAGES ({MAX_PAGES}) result pages; later results are missing")
+    if total is not None and len(items) != total:
+        print(f"Got {len(items)} of the {total} results the portal reported")
+    return items
 
-    # URL for Advanced Search (POST)
-    search_url = "https://planningaccess.york.gov.uk/online-applications/advancedSearchResults.do?action=firstPage"
-    
-    # Form Data for "Decided Between X and Y"
+def meta_fields(meta_text):
+    """'Ref. No: X | Received: Mon 02 Feb 2026 | Status: Decided' -> {'Ref. No': 'X', ...}"""
+    fields = {}
+    for part in meta_text.split('|'):
+        if ':' in part:
+            label, value = part.split(':', 1)
+            fields[label.strip()] = value.strip()
+    return fields
+
+def _to_ddmmyyyy(text):
+    """Portal date text ('Wed 04 Feb 2026' or dd/mm/yyyy) -> 'dd/mm/yyyy', None if unparseable."""
+    for fmt in ('%a %d %b %Y', '%d/%m/%Y', '%d %b %Y'):
+        try:
+            return datetime.strptime(text, fmt).strftime('%d/%m/%Y')
+        except (TypeError, ValueError):
+            pass
+    return None
+
+def _result(item, status, decision_date):
+    return {
+        'keyval': item['keyval'],
+        'reference': item['reference'],
+        'address': item['address'],
+        'status': status,
+        'decision_date': decision_date
+    }
+
+def search_decided_on(day, throttle):
+    """
+    Every application decided on `day` (all result pages). The search covers a single
+    day, so that day is each item's real decision date. Returns None when the portal
+    did not answer with a results page (advanced search unavailable).
+    """
+    session = new_session(throttle)
+    day_str = day.strftime('%d/%m/%Y')
+
+    # Form Data for "Decided Between X and Y" (X = Y = day)
     payload = {
         'searchType': 'Application',
         'caseType': '',
         'decisionType': '',
-        'date(applicationDecisionStart)': start_str,
-        'date(applicationDecisionEnd)': end_str,
-        'caseStatus': '' 
+        'date(applicationDecisionStart)': day_str,
+        'date(applicationDecisionEnd)': day_str,
+        'caseStatus': ''
     }
-    
-    try:
-        res = session.post(search_url, data=payload, headers=HEADERS, timeout=30)
-        
-        # DEBUG: unexpected redirect or error?
-        if "matching results found" not in res.text and "Results" not in res.text and "searchresult" not in res.text:
-             # Maybe monthly or weekly list is safer?
-             print("Advanced search returned no obvious results list. Trying Weekly List method...")
-             return search_weekly_list(session)
-             
-        soup = BeautifulSoup(res.text, 'html.parser')
-        
-        # Check for results list
-        results = []
-        items = soup.find_all('li', class_='searchresult')
-        
-        print(f"Found {len(items)} items on first page.")
-        
-        for item in items:
-            link_tag = item.find('a', href=lambda h: h and 'keyVal=' in h)
-            if not link_tag: continue
-            
-            href = link_tag['href']
-            keyval = href.split('keyVal=')[1].split('&')[0]
-            reference = link_tag.get_text(strip=True)
-            
-            addr_tag = item.find('p', class_='address')
-            address = addr_tag.get_text(strip=True) if addr_tag else "Unknown Address"
-            
-            meta_tag = item.find('p', class_='metaInfo')
-            meta_text = meta_tag.get_text(strip=True) if meta_tag else ""
-            
-            status = "Unknown"
-            if "Status:" in meta_text:
-                status = meta_text.split("Status:")[1].strip()
-                
-            results.append({
-                'keyval': keyval,
-                'reference': reference,
-                'address': address,
-                'status': status,
-                'decision_date': end_str 
-            })
-            
-        return results
+    throttle()
+    res = session.post(f"{BASE_URL}/advancedSearchResults.do?action=firstPage", data=payload, headers=HEADERS, timeout=30)
 
-    except Exception as e:
-        print(f"Search failed: {e}")
+    if "No results found" in res.text:
         return []
+    if "matching results found" not in res.text and "Results" not in res.text and "searchresult" not in res.text:
+        return None
+
+    results = []
+    for item in fetch_all_pages(session, res.text, throttle):
+        status = meta_fields(item['meta']).get('Status', 'Unknown')
+        results.append(_result(item, status, day_str))
+    return results
 
-def search_weekly_list(session):
+def search_recent_decisions(days=7, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE):
     """
-    Fallback: Scrape the 'Weakly List' for Decided applications.
-    This is often more robust than advanced search form submission.
+    Searches for applications decided in the last N days: one single-day search per
+    day, run concurrently under one shared rate limit, each following every result page.
+    Falls back to the weekly lists when the advanced search doesn't work.
     """
-    print("Searching Weekly List (Decided)...")
-    url = "https://planningaccess.york.gov.uk/online-applications/weeklyListSearchResults.do?action=firstPage"
-    
-    # We want "Decided" applications for "This Week"
-    # Usually requires parsing the "Weekly List" form first to get dates?
-    # Let's try simple GET parameters if possible, otherwise POST.
-    
-    # Only reliable way is usually simulating the form post.
-    # dateType: DC_Decided
-    
+    print(f"Searching for decisions in the last {days} days...")
+    limiter = enrichment.RateLimiter(rate, burst=workers)
+    today = datetime.now().date()
+    dates = [today - timedelta(days=i) for i in range(days + 1)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {day: pool.submit(search_decided_on, day, limiter.wait) for day in dates}
+
+    found = {}
+    answered = 0
+    for day, future in futures.items():
+        try:
+            items = future.result()
+        except Exception as e:
+            print(f"Search for {day} failed: {e}")
+            continue
+        if items is None:
+            continue
+        answered += 1
+        print(f"{day}: {len(items)} decisions")
+        for item in items:
+            found[item['keyval']] = item
+
+    if not answered:
+        print("Advanced search returned no obvious results list. Trying Weekly List method...")
+        return search_weekly_list(weeks=days // 7 + 1, workers=workers, limiter=limiter)
+    return list(found.values())
+
+def search_week(week, throttle):
+    """All 'Decided' items of one weekly list (all result pages)."""
+    session = new_session(throttle)
     payload = {
         'searchType': 'Application',
         'dateType': 'DC_Decided', # Decided Applications
-        'week': '0', # Current Week? Or explicit usage?
-        # Typically the form sends 'week' as "10 Feb 2026" etc.
+        'week': week
     }
-    
-    # Let's actually use the Monthly List as it covers more ground? Or just stick to Weekly.
-    # Let's try to get the Weekly List page to find valid 'week' values.
-    
+    throttle()
+    res = session.post(f"{BASE_URL}/weeklyListSearchResults.do?action=firstPage", data=payload, headers=HEADERS, timeout=30)
+
+    results = []
+    for item in fetch_all_pages(session, res.text, throttle):
+        # Weekly lists don't always show the decision date; use it when the metaInfo line has one
+        meta = meta_fields(item['meta'])
+        decided = next((v for k, v in meta.items() if k.startswith('Decided') or k.startswith('Decision')), None)
+        decision_date = _to_ddmmyyyy(decided)
+        if meta.get('Status') is None and decision_date is None:
+            # Only "on the decided list": no status and no date to apply (skipped, as before)
+            continue
+        results.append(_result(item, meta.get('Status', 'Decided'), decision_date))
+    return results
+
+def search_weekly_list(weeks=1, workers=DEFAULT_WORKERS, limiter=None, rate=DEFAULT_RATE):
+    """
+    Fallback: Scrape the 'Weekly List' of Decided applications for the latest `weeks` weeks,
+    concurrently, every result page. Items without a published decision date have
+    decision_date None; items showing neither a date nor a status are left out.
+    """
+    print("Searching Weekly List (Decided)...")
+    limiter = limiter or enrichment.RateLimiter(rate, burst=workers)
+
     try:
-         res_form = session.get("https://planningaccess.york.gov.uk/online-applications/search.do?action=weeklyList", headers=HEADERS)
-         soup_form = BeautifulSoup(res_form.text, 'html.parser')
-         
-         # Find the Week Selector
-         # <select name="week" id="week"> ... </select>
-         select = soup_form.find('select', id='week')
-         if not select:
-             print("Could not find week selector.")
-             return []
-             
-         options = select.find_all('option')
-         if not options: return []
-         
-         # Take the first option (Current Week)
-         latest_week = options[0]['value']
-         print(f"Scraping Weekly List for week: {latest_week}")
-         
-         payload['week'] = latest_week
-         
-         res = session.post(url, data=payload, headers=HEADERS)
-         soup = BeautifulSoup(res.text, 'html.parser')
-         
-         items = soup.find_all('li', class_='searchresult')
-         results = []
-         for item in items:
-            link_tag = item.find('a', href=lambda h: h and 'keyVal=' in h)
-            if not link_tag: continue
-            
-            href = link_tag['href']
-            keyval = href.split('keyVal=')[1].split('&')[0]
-            reference = link_tag.get_text(strip=True)
-            
-            addr_tag = item.find('p', class_='address')
-            address = addr_tag.get_text(strip=True) if addr_tag else "Unknown Address"
-            
-            results.append({
-                'keyval': keyval,
-                'reference': reference,
-                'address': address,
-                'status': 'Decided', # Implicit
-                'decision_date': 'This Week'
-            })
-            
-         return results
-         
+        # Find the Week Selector
+        # <select name="week" id="week"> ... </select>
+        session = new_session(limiter.wait)
+        limiter.wait()
+        res_form = session.get(f"{BASE_URL}/search.do?action=weeklyList", headers=HEADERS, timeout=30)
+        options = portal_extract.week_options(res_form.text)
+        if not options:
+            print("Could not find week selector.")
+            return []
     except Exception as e:
         print(f"Weekly search failed: {e}")
         return []
 
+    # Options are newest first
+    selected = options[:weeks]
+    print(f"Scraping Weekly Lists for weeks: {', '.join(selected)}")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {week: pool.submit(search_week, week, limiter.wait) for week in selected}
+
+    found = {}
+    for week, future in futures.items():
+        try:
+            for item in future.result():
+                found.setdefault(item['keyval'], item)
+        except Exception as e:
+            print(f"Weekly search for {week} failed: {e}")
+    return list(found.values())
+
 if __name__ == "__main__":
-    results = search_recent_decisions(days=7)
+    parser = argparse.ArgumentParser(description="List applications decided recently on the York portal.")
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Portal requests per second")
+    args = parser.parse_args()
+    results = search_recent_decisions(days=args.days, workers=args.workers, rate=args.rate)
     print(f"Found {len(results)} recent decisions.")
     for r in results:
         print(r)
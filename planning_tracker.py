@@ -1,13 +1,16 @@
 import requests
 import json
 import os
+import shutil
 import pandas as pd
 from datetime import datetime, timezone, timedelta
+import http_cache
 
 # Constants
 CSV_URL = "https://data-cyc.opendata.arcgis.com/datasets/7044d1920639460da3fc4a3fa9273107_5.csv"
 LOCAL_CSV_FILE = "Planning_Applications.csv"
 STATE_FILE = "tracker_state.json"
+CHUNK_ROWS = 10000 # CSV rows scanned at a time (keeps memory flat for large files)
 
 def load_state():
     if os.path.exists(STATE_FILE):
@@ -22,21 +25,18 @@ def save_state(state):
 def check_and_download_update(current_state):
     print("Checking for updates...")
     try:
-        # Check server headers
-        head_response = requests.head(CSV_URL, allow_redirects=True, timeout=10)
-        head_response.raise_for_status()
+        # One conditional GET (If-None-Match / If-Modified-Since from the HTTP cache):
+        # unchanged -> 304 and no body, changed -> the body is streamed into the cache
+        response = http_cache.get(requests.Session(), CSV_URL, timeout=30)
+        response.raise_for_status()
         
-        server_etag = head_response.headers.get('ETag', '').strip('"')
+        server_etag = (response.meta.get('etag') or '').strip('"')
         local_etag = current_state.get('last_download_etag')
         
-        if server_etag != local_etag:
-            print(f"Update found (Server: {server_etag} != Local: {local_etag}). Downloading...")
-            # Download file
-            response = requests.get(CSV_URL, allow_redirects=True, timeout=30)
-            response.raise_for_status()
-            
-            with open(LOCAL_CSV_FILE, 'wb') as f:
-                f.write(response.content)
+        if response.changed or server_etag != local_etag or not os.path.exists(LOCAL_CSV_FILE):
+            print(f"Update found (Server: {server_etag} != Local: {local_etag}). Saving {LOCAL_CSV_FILE}...")
+            with response.open() as src, open(LOCAL_CSV_FILE, 'wb') as f:
+                shutil.copyfileobj(src, f)
             
             print("Download complete.")
             
@@ -46,7 +46,7 @@ def check_and_download_update(current_state):
             # because we haven't processed the rows yet.
             return True, current_state
         else:
-            print("No file update required (ETag matches).")
+            print("No file update required (304 Not Modified).")
             return False, current_state
             
     except Exception as e:
@@ -73,13 +73,6 @@ def find_new_approvals(current_state):
     print(f"Looking for approvals modified after: {last_check_date}")
 
     try:
-        df = pd.read_csv(LOCAL_CSV_FILE)
-        
-        # Ensure DATE_MODIFIED is datetime
-        # (Assuming DATE_MODIFIED is the column that updates when status changes to Approved)
-        # Using 'coerce' to handle extensive errors, but usually we want to see them.
-        df['DATE_MODIFIED'] = pd.to_datetime(df['DATE_MODIFIED'], errors='coerce')
-        
         # Filter for Approvals
         # HAPP = Householder Approved?
         # PER = Permitted?
@@ -88,18 +81,27 @@ def find_new_approvals(current_state):
         approval_codes = ['HAPP', 'PER', 'PERLHE', 'HREF'] # Added HREF (Refused) just in case user wants 'decisions', but prompt said 'approved'. Removing HREF for now to match prompt "newly approved".
         approval_codes = ['HAPP', 'PER', 'PERLHE', 'CER'] # CER = Certificate?
         
-        # Actually filter
-        approved_df = df[df['DECSN'].isin(approval_codes)].copy()
-        
-        # Filter by Date (Newer than last check)
-        # Handle timezone awareness mismatch if necessary
-        # The CSV dates seemed to have +00 timezone in previous view_file.
-        
-        if approved_df['DATE_MODIFIED'].dt.tz is None:
-             # If CSV has no TZ, assume UTC or match last_check
-             approved_df['DATE_MODIFIED'] = approved_df['DATE_MODIFIED'].dt.tz_localize('UTC')
+        # Scan the file in chunks, reading only the columns we report on,
+        # and keep just the matching rows (memory stays flat however big the CSV gets)
+        matches = []
+        wanted = {'REFVAL', 'PROPOSAL', 'DATE_MODIFIED', 'DECSN'}
+        for df in pd.read_csv(LOCAL_CSV_FILE, chunksize=CHUNK_ROWS, usecols=lambda c: c in wanted):
+            # Ensure DATE_MODIFIED is datetime
+            # (Assuming DATE_MODIFIED is the column that updates when status changes to Approved)
+            # Using 'coerce' to handle extensive errors, but usually we want to see them.
+            approved_df = df[df['DECSN'].isin(approval_codes)].copy()
+            approved_df['DATE_MODIFIED'] = pd.to_datetime(approved_df['DATE_MODIFIED'], errors='coerce')
+            
+            # Filter by Date (Newer than last check)
+            # Handle timezone awareness mismatch if necessary
+            # The CSV dates seemed to have +00 timezone in previous view_file.
+            if approved_df['DATE_MODIFIED'].dt.tz is None:
+                 # If CSV has no TZ, assume UTC or match last_check
+                 approved_df['DATE_MODIFIED'] = approved_df['DATE_MODIFIED'].dt.tz_localize('UTC')
+            
+            matches.append(approved_df[approved_df['DATE_MODIFIED'] > last_check_date])
         
-        new_approvals = approved_df[approved_df['DATE_MODIFIED'] > last_check_date]
+        new_approvals = pd.concat(matches) if matches else pd.DataFrame(columns=sorted(wanted))
         
         print(f"Found {len(new_approvals)} new approvals.")
         
@@ -0,0 +1,117 @@
+"""
+Field extraction from Idox portal pages with lxml.
+
+Each page is parsed once; everything after that is precompiled XPath over the tree.
+The summary / details tabs are label-value tables (<tr><th>Label</th><td>Value</td></tr>),
+read in a single pass into a label -> value map. Search / weekly list results are
+<li class="searchresult"> items. Text is flattened like BeautifulSoup's
+get_text(strip=True) (each text piece stripped, joined with ''), so values match
+what the scraper extracted before.
+"""
+import re
+
+from lxml import etree
+from lxml import html as lxml_html
+
+_LABEL_ROWS = etree.XPath('//tr[th and td]')
+_ROW_LABEL = etree.XPath('th[1]')
+_ROW_VALUE = etree.XPath('th[1]/following-sibling::td[1]')
+_KEYVAL_HREFS = etree.XPath("//a[contains(@href, 'keyVal=')]/@href")
+_RESULT_ITEMS = etree.XPath("//li[contains(concat(' ', normalize-space(@class), ' '), ' searchresult ')]")
+_RESULT_LINK = etree.XPath(".//a[contains(@href, 'keyVal=')][1]")
+_RESULT_ADDRESS = etree.XPath(".//p[contains(concat(' ', normalize-space(@class), ' '), ' address ')][1]")
+_RESULT_META = etree.XPath(".//p[contains(concat(' ', normalize-space(@class), ' '), ' metaInfo ')][1]")
+_WEEK_OPTIONS = etree.XPath("//select[@id='week']/option/@value")
+_PAGER_NEXT = etree.XPath("//a[contains(concat(' ', normalize-space(@class), ' '), ' next ')]/@href")
+_PAGER_SHOWING = etree.XPath("//span[contains(concat(' ', normalize-space(@class), ' '), ' showing ')]")
+_MATCHING_TOTAL = re.compile(r'(\d[\d,]*)\s+matching results? found')
+_SHOWING_TOTAL = re.compile(r'of\s+(\d[\d,]*)')
+
+def parse(page):
+    """One lxml parse of a page (str or bytes)."""
+    if isinstance(page, str):
+        try:
+            return lxml_html.fromstring(page)
+        except ValueError:
+            # str with an XML encoding declaration: let lxml decode the bytes itself
+            page = page.encode('utf-8')
+    return lxml_html.fromstring(page)
+
+def text_of(element):
+    return ''.join(s.strip() for s in element.itertext()) if element is not None else ''
+
+def keyval_from_href(href):
+    return href.split('keyVal=')[1].split('&')[0]
+
+def label_map(tree):
+    """{th label: td value} over every label-value row of the page, in document order."""
+    fields = {}
+    for row in _LABEL_ROWS(tree):
+        label = text_of(_ROW_LABEL(row)[0])
+        value = _ROW_VALUE(row)
+        if label and label not in fields and value:
+            fields[label] = text_of(value[0])
+    return fields
+
+def lookup(fields, needle):
+    """The value labelled `needle` exactly, else the first label containing it (None if absent)."""
+    if needle in fields:
+        return fields[needle]
+    return next((v for k, v in fields.items() if needle in k), None)
+
+def extract_summary(page):
+    """Summary tab: raw 'Decision Issued Date' text, status and address (None when missing/empty)."""
+    fields = label_map(parse(page))
+    return {
+        'decision_date': lookup(fields, 'Decision Issued Date') or None,
+        'status': lookup(fields, 'Status'),
+        'address': lookup(fields, 'Address') or None,
+    }
+
+def extract_details(page):
+    """Details tab: agent company name and address (None when missing/empty)."""
+    fields = label_map(parse(page))
+    return {
+        'agent': lookup(fields, 'Agent Company Name') or None,
+        'address': lookup(fields, 'Address') or None,
+    }
+
+def first_keyval_link(page):
+    """keyVal of the first application link on the page (self-healing search), or None."""
+    hrefs = _KEYVAL_HREFS(parse(page))
+    return keyval_from_href(hrefs[0]) if hrefs else None
+
+def extract_search_results(page):
+    """
+    Search / weekly list result items: keyval, reference (link text), address and the
+    metaInfo line, plus the 'next page' href if the results are paged.
+    """
+    tree = parse(page)
+    results = []
+    for item in _RESULT_ITEMS(tree):
+        link = _RESULT_LINK(item)
+        if not link:
+            continue
+        address = _RESULT_ADDRESS(item)
+        meta = _RESULT_META(item)
+        results.append({
+            'keyval': keyval_from_href(link[0].get('href')),
+            'reference': text_of(link[0]),
+            'address': text_of(address[0]) if address else "Unknown Address",
+            'meta': text_of(meta[0]) if meta else "",
+        })
+    next_href = _PAGER_NEXT(tree)
+    return results, (next_href[0] if next_href else None)
+
+def result_total(page):
+    """The portal's total result count ('134 matching results found' / 'Showing 1-10 of 134'), None if not shown."""
+    tree = parse(page)
+    match = _MATCHING_TOTAL.search(text_of(tree))
+    if not match:
+        showing = _PAGER_SHOWING(tree)
+        match = _SHOWING_TOTAL.search(text_of(showing[0])) if showing else None
+    return int(match.group(1).replace(',', '')) if match else None
+
+def week_options(page):
+    """Values of the weekly list's week selector (newest first)."""
+    return list(_WEEK_OPTIONS(parse(page)))
@@ -0,0 +1,133 @@
+"""
+Persistent priority queue for the enrichment scraper (`scrape_queue` table).
+
+Each application is queued at most once, with a priority taken from the
+reason it needs scraping (see ARCHITECTURE_PLAN.md, "The Enricher"):
+new record > status change > data gap > stale. Failures back off
+exponentially via next_attempt_at and move to the 'dead' state after
+MAX_ATTEMPTS, so hopeless keyvals stop consuming the request budget.
+
+States: 'pending' (waiting / retrying), 'done', 'dead'.
+"""
+from datetime import datetime, timedelta
+
+PRIORITY_NEW = 100
+PRIORITY_STATUS_CHANGE = 80
+PRIORITY_DATA_GAP = 40
+PRIORITY_STALE = 10
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = timedelta(hours=3)  # 3h, 6h, 12h, 24h, then dead
+STALE_AFTER = timedelta(days=30)
+
+# Re-queueing rules on conflict:
+#  - pending: keep the higher priority (and its reason)
+#  - done: back to pending with a fresh attempt count
+#  - dead: only revived by new information (status change or new record)
+_UPSERT = f"""
+    ON CONFLICT(keyval) DO UPDATE SET
+        priority = CASE WHEN scrape_queue.state = 'pending'
+                        THEN max(scrape_queue.priority, excluded.priority)
+                        ELSE excluded.priority END,
+        reason = CASE WHEN scrape_queue.state = 'pending' AND scrape_queue.priority >= excluded.priority
+                      THEN scrape_queue.reason ELSE excluded.reason END,
+        attempts = CASE WHEN scrape_queue.state = 'pending' THEN scrape_queue.attempts ELSE 0 END,
+        next_attempt_at = CASE WHEN scrape_queue.state = 'pending' THEN scrape_queue.next_attempt_at END,
+        state = 'pending',
+        updated_at = excluded.updated_at
+    WHERE scrape_queue.state != 'dead' OR excluded.priority >= {PRIORITY_STATUS_CHANGE}
+"""
+
+def enqueue(conn, keyvals, reason, priority):
+    """Queues the given keyvals (one executemany). Caller commits."""
+    now = datetime.now()
+    conn.executemany(
+        "INSERT INTO scrape_queue (keyval, priority, reason, state, attempts, enqueued_at, updated_at) "
+        "VALUES (?, ?, ?, 'pending', 0, ?, ?)" + _UPSERT,
+        [(kv, priority, reason, now, now) for kv in keyvals]
+    )
+
+def enqueue_select(conn, select_sql, params, reason, priority):
+    """
+    Set-based enqueue: `select_sql` must return a single keyval column.
+    Returns the number of rows queued or re-queued. Caller commits.
+    """
+    now = datetime.now()
+    return conn.execute(
+        "INSERT INTO scrape_queue (keyval, priority, reason, state, attempts, enqueued_at, updated_at) "
+        f"SELECT keyval, ?, ?, 'pending', 0, ?, ? FROM ({select_sql}) WHERE true" + _UPSERT,
+        (priority, reason, now, now, *params)
+    ).rowcount
+
+def refresh(conn):
+    """
+    Queues the background work the sync itself does not flag:
+    data gaps (no agent/address yet), stale records and any legacy needs_scrape backlog.
+    """
+    stale_before = datetime.now() - STALE_AFTER
+    with conn:
+        gaps = enqueue_select(conn, """
+            SELECT a.keyval FROM applications a
+            WHERE (a.agent_name IS NULL OR a.address IS NULL)
+              AND NOT EXISTS (SELECT 1 FROM scrape_queue q WHERE q.keyval = a.keyval)
+        """, (), 'data_gap', PRIORITY_DATA_GAP)
+        backlog = enqueue_select(conn, """
+            SELECT a.keyval FROM applications a
+            WHERE a.needs_scrape = 1
+              AND NOT EXISTS (SELECT 1 FROM scrape_queue q WHERE q.keyval = a.keyval)
+        """, (), 'backlog', PRIORITY_DATA_GAP)
+        stale = enqueue_select(conn, """
+            SELECT a.keyval FROM applications a
+            JOIN scrape_queue q ON q.keyval = a.keyval
+            WHERE q.state = 'done' AND a.last_scraped_details < ?
+        """, (stale_before,), 'stale', PRIORITY_STALE)
+    return {'data_gap': gaps, 'backlog': backlog, 'stale': stale}
+
+def next_batch(conn, limit=500):
+    """Due pending items, highest priority first, newest applications first within a priority."""
+    return conn.execute("""
+        SELECT q.keyval, a.reference, a.status, q.priority, q.reason, q.attempts
+        FROM scrape_queue q JOIN applications a ON a.keyval = q.keyval
+        WHERE q.state = 'pending' AND (q.next_attempt_at IS NULL OR q.next_attempt_at <= ?)
+        ORDER BY q.priority DESC, a.received_date DESC
+        LIMIT ?
+    """, (datetime.now(), limit)).fetchall()
+
+def mark_done(conn, keyvals):
+    """Caller commits."""
+    now = datetime.now()
+    conn.executemany(
+        "UPDATE scrape_queue SET state = 'done', last_error = NULL, next_attempt_at = NULL, updated_at = ? "
+        "WHERE keyval = ?",
+        [(now, kv) for kv in keyvals]
+    )
+
+def mark_failed(conn, failures):
+    """
+    `failures`: iterable of (keyval, error). Bumps attempts and schedules the retry
+    with exponential backoff; dead-letters after MAX_ATTEMPTS. Items not queued yet
+    are enqueued first (e.g. a failed on-demand scrape). Caller commits.
+    """
+    now = datetime.now()
+    failures = list(failures)
+    enqueue(conn, [kv for kv, _ in failures], 'retry', PRIORITY_DATA_GAP)
+    rows = conn.execute(
+        f"SELECT keyval, attempts FROM scrape_queue WHERE keyval IN ({','.join('?' * len(failures))})",
+        [kv for kv, _ in failures]
+    ).fetchall() if failures else []
+    attempts = {r[0]: r[1] for r in rows}
+
+    updates = []
+    for kv, error in failures:
+        n = attempts.get(kv, 0) + 1
+        state = 'dead' if n >= MAX_ATTEMPTS else 'pending'
+        retry_at = None if state == 'dead' else now + BACKOFF_BASE * (2 ** (n - 1))
+        updates.append((n, state, retry_at, str(error)[:500] if error else None, now, kv))
+    conn.executemany(
+        "UPDATE scrape_queue SET attempts = ?, state = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+        "WHERE keyval = ?",
+        updates
+    )
+
+def summary(conn):
+    return {r[0]: r[1] for r in conn.execute("SELECT state, count(*) FROM scrape_queue GROUP BY state")}
@@ -1,6 +1,9 @@
 import requests
-from bs4 import BeautifulSoup
+import os
+import threading
 from datetime import datetime, timedelta
+import http_cache
+import portal_extract
 
 # Headers for requests
 HEADERS = {
@@ -10,7 +13,34 @@ HEADERS = {
     'Referer': 'https://planningaccess.york.gov.uk/online-applications/search.do?action=advanced'
 }
 
-def scrape_application_details(keyval, reference=None):
+BASE_URL = "https://planningaccess.york.gov.uk/online-applications"
+# A portal page fetched this recently is reused from the HTTP cache without a request
+PORTAL_MAX_AGE = int(os.environ.get('PORTAL_CACHE_MAX_AGE', 3600))
+
+_local = threading.local()
+
+def get_session():
+    """
+    Per-thread requests.Session, reused across applications so cookies and
+    keep-alive connections to the portal survive between scrapes.
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        _local.session = session
+    return session
+
+def _summary_url(keyval):
+    return f"{BASE_URL}/applicationDetails.do?activeTab=summary&keyVal={keyval}"
+
+def _get(session, url, throttle=None):
+    # Through the conditional-GET cache; every request actually sent to the portal
+    # passes through the (optional) shared rate limiter, cache hits don't
+    return http_cache.get(session, url, headers=HEADERS, timeout=15,
+                          max_age=PORTAL_MAX_AGE, before_request=throttle)
+
+def scrape_application_details(keyval, reference=None, throttle=None, session=None):
     """
     Scrapes the 'activeTab=details' and 'activeTab=summary' pages for a given keyval.
     Includes self-healing logic to find the correct keyval if the initial one is invalid,
@@ -21,106 +51,74 @@ def scrape_application_details(keyval, reference=None):
       - decision_date (str 'dd/mm/yy' or None)
       - success (bool)
       - portal_keyval (str or None) - The keyval actually used for scraping, if different from input.
+    `throttle` is called before every HTTP request (e.g. enrichment.RateLimiter.wait).
+    Each page is fetched at most once: summary + details (2 requests), or
+    summary + search + healed summary + details when the keyval needs healing.
     """
     if not keyval:
         return {'success': False, 'error': 'No KeyVal'}
         
     details = {'address': None, 'agent': None, 'decision_date': None, 'success': False, 'portal_keyval': None}
     
-    session = requests.Session()
+    session = session or get_session()
     active_kv = keyval
     
     try:
         # --- Step 0: Validate / Soft-Check KeyVal using Summary Tab ---
-        # We start with summary because it's the main landing page
-        url_summary = f"https://planningaccess.york.gov.uk/online-applications/applicationDetails.do?activeTab=summary&keyVal={keyval}"
-        res_summary = session.get(url_summary, headers=HEADERS, timeout=15)
+        # We start with summary because it's the main landing page.
+        # The same response is parsed in Step 1 unless the keyval gets healed.
+        res_summary = _get(session, _summary_url(keyval), throttle)
         
         # Self-Healing: Check if KeyVal is valid
         if "Details not available" in res_summary.text or "Comparison" in res_summary.text:
             if reference:
                 print(f"[Heal] KeyVal {keyval} failed. Searching for ref {reference}...")
-                search_url = f"https://planningaccess.york.gov.uk/online-applications/simpleSearchResults.do?action=firstPage&searchType=Application&searchCriteria.reference={reference}"
-                res_search = session.get(search_url, headers=HEADERS, timeout=15)
+                search_url = f"{BASE_URL}/simpleSearchResults.do?action=firstPage&searchType=Application&searchCriteria.reference={reference}"
+                res_search = _get(session, search_url, throttle)
                 
                 # Extract correct link
-                soup_search = BeautifulSoup(res_search.text, 'html.parser')
-                link = soup_search.find('a', href=lambda h: h and 'keyVal=' in h)
-                
-                if link:
-                    try:
-                        # href example: ...&keyVal=ABC...
-                        new_kv = link['href'].split('keyVal=')[1].split('&')[0]
-                        print(f"[Heal] Found replacement KeyVal: {new_kv}")
-                        details['portal_keyval'] = new_kv
-                        active_kv = new_kv
-                        # Re-fetch summary with new KV
-                        url_summary = f"https://planningaccess.york.gov.uk/online-applications/applicationDetails.do?activeTab=summary&keyVal={active_kv}"
-                        res_summary = session.get(url_summary, headers=HEADERS, timeout=15)
-                    except Exception as ex:
-                        print(f"Failed to parse new keyval: {ex}")
+                new_kv = portal_extract.first_keyval_link(res_search.text)
+                if new_kv:
+                    print(f"[Heal] Found replacement KeyVal: {new_kv}")
+                    details['portal_keyval'] = new_kv
+                    active_kv = new_kv
+                    # Re-fetch summary with new KV
+                    res_summary = _get(session, _summary_url(active_kv), throttle)
 
         # --- Step 1: Parse Summary (Date & Address Fallback) ---
-        url_summary = f"https://planningaccess.york.gov.uk/online-applications/applicationDetails.do?activeTab=summary&keyVal={active_kv}"
-        res_summary = session.get(url_summary, headers=HEADERS, timeout=15)
         res_summary.raise_for_status() # Check for 403/500
-        
-        soup_sum = BeautifulSoup(res_summary.text, 'html.parser')
+        summary = portal_extract.extract_summary(res_summary.text)
         
         # Date
-        date_node = soup_sum.find(string=lambda t: t and "Decision Issued Date" in t)
-        if date_node:
-            row = date_node.find_parent('tr')
-            if row:
-                td = row.find('td')
-                if td:
-                    raw_date = td.get_text(strip=True)
-                    try:
-                         # Format: Wed 04 Feb 2026 -> %a %d %b %Y
-                        dt = datetime.strptime(raw_date, '%a %d %b %Y')
-                        details['decision_date'] = dt.strftime('%d/%m/%y')
-                    except: details['decision_date'] = raw_date
+        raw_date = summary['decision_date']
+        if raw_date:
+            try:
+                # Format: Wed 04 Feb 2026 -> %a %d %b %Y
+                dt = datetime.strptime(raw_date, '%a %d %b %Y')
+                details['decision_date'] = dt.strftime('%d/%m/%y')
+            except ValueError: details['decision_date'] = raw_date
         
         # Status (Phase 3: Cross Validation)
-        status_node = soup_sum.find('th', string=lambda t: t and 'Status' in t)
-        if status_node:
-             td = status_node.find_next_sibling('td')
-             if td: details['scraped_status'] = td.get_text(strip=True)
+        if summary['status'] is not None:
+            details['scraped_status'] = summary['status']
 
         # Address (Fallback if not found in Details, but we parse here too)
-        # Often in Summary tab, address is in a table too.
-        if not details['address']:
-             addr_th = soup_sum.find('th', string=lambda t: t and 'Address' in t)
-             if addr_th:
-                 td = addr_th.find_next_sibling('td')
-                 if td: 
-                    addr_text = td.get_text(strip=True)
-                    if addr_text: details['address'] = addr_text
+        details['address'] = summary['address']
 
         # --- Step 2: Parse Details Tab (Agent & Primary Address) ---
-        url_details = f"https://planningaccess.york.gov.uk/online-applications/applicationDetails.do?activeTab=details&keyVal={active_kv}"
-        res_details = session.get(url_details, headers=HEADERS, timeout=15)
+        url_details = f"{BASE_URL}/applicationDetails.do?activeTab=details&keyVal={active_kv}"
+        res_details = _get(session, url_details, throttle)
         res_details.raise_for_status()
-        
-        soup_det = BeautifulSoup(res_details.text, 'html.parser')
+        page = portal_extract.extract_details(res_details.text)
         
         # Agent
-        agent_th = soup_det.find('th', string=lambda t: t and 'Agent Company Name' in t)
-        if agent_th:
-            td = agent_th.find_next_sibling('td')
-            if td: 
-                agent_text = td.get_text(strip=True)
-                if agent_text: details['agent'] = agent_text
+        if page['agent']:
+            details['agent'] = page['agent']
             
         # Address (Primary check)
-        # Override summary address if detailed one is found? Usually they are same.
-        # But details tab is authoritative.
-        addr_th = soup_det.find('th', string=lambda t: t and 'Address' in t)
-        if addr_th:
-            td = addr_th.find_next_sibling('td')
-            if td: 
-                addr_text = td.get_text(strip=True)
-                if addr_text: details['address'] = addr_text
+        # Details tab is authoritative when it has one
+        if page['address']:
+            details['address'] = page['address']
         
         details['success'] = True
         
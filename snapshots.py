@@ -0,0 +1,277 @@
+"""
+The database is kept out of git: what the workflow commits is a compact snapshot plus
+small per-run change logs, and every checkout rebuilds the DB from them.
+
+  snapshots/manifest.json                snapshot, ordered delta list, last run's metrics
+  snapshots/snapshot.<hash>.db.gz        database.BASE_TABLES only (VACUUM INTO, then indexes,
+                                         triggers and derived tables dropped), gzipped
+  snapshots/history.<hash>.db.gz         the status_history archive (history.py), if any
+  snapshots/delta.<n>.<hash>.jsonl.gz    one run's changes: per changed key, the row's
+                                         current state or null (deleted)
+
+export() runs at the end of each sync: it writes the change_log (database.init_change_log)
+as one delta, or a fresh snapshot (dropping the deltas) once there are MAX_DELTAS of them,
+they add up to SNAPSHOT_RATIO of the snapshot, the schema changed or rows were archived.
+restore() runs from database.init_db on a fresh checkout: it unpacks the snapshot, replays
+the deltas in order, and init_db then recreates indexes and derived tables.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+import database
+
+SNAPSHOT_DIR = 'snapshots'
+MANIFEST_PATH = os.path.join(SNAPSHOT_DIR, 'manifest.json')
+FORMAT_VERSION = 1
+MAX_DELTAS = 28 # a week of 6-hourly runs
+SNAPSHOT_RATIO = 0.5 # deltas this big relative to the snapshot: take a new snapshot
+
+def content_hash(payload):
+    return hashlib.sha256(payload).hexdigest()[:12]
+
+def load_manifest():
+    """The manifest, or None if missing / unreadable / other format."""
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == FORMAT_VERSION else None
+
+def write_file(stem, ext, payload):
+    """Writes snapshots/<stem>.<hash>.<ext>.gz; returns its manifest entry (hash of the uncompressed bytes)."""
+    digest = content_hash(payload)
+    name = f"{stem}.{digest}.{ext}.gz"
+    data = gzip.compress(payload, 6, mtime=0)
+    with open(os.path.join(SNAPSHOT_DIR, name), 'wb') as f:
+        f.write(data)
+    return {'file': name, 'hash': digest, 'bytes': len(data), 'raw_bytes': len(payload)}
+
+def read_file(entry):
+    with open(os.path.join(SNAPSHOT_DIR, entry['file']), 'rb') as f:
+        payload = gzip.decompress(f.read())
+    if content_hash(payload) != entry['hash']:
+        raise ValueError(f"{entry['file']} does not match its hash")
+    return payload
+
+def schema_fingerprint(conn):
+    """Changes whenever a BASE_TABLES definition does (e.g. a migration added a column)."""
+    tables = sorted(database.BASE_TABLES)
+    rows = conn.execute(f"SELECT name, sql FROM main.sqlite_master WHERE type = 'table' AND name IN "
+                        f"({','.join('?' * len(tables))}) ORDER BY name", tables).fetchall()
+    return content_hash('\n'.join(f"{r[0]}:{r[1]}" for r in rows).encode('utf-8'))
+
+def archive_fingerprint(conn):
+    """Archived history is append-only: row count + last id identify its content. None without an archive."""
+    if database.history_source(conn) == 'status_history':
+        return None
+    count, last = conn.execute(f"SELECT count(*), max(id) FROM {database.HISTORY_ARCHIVE}.status_history").fetchone()
+    return f"{count}:{last}"
+
+def base_snapshot(conn):
+    """Bytes of a compacted copy of the main DB holding just the BASE_TABLES rows."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'snapshot.db')
+        conn.execute("VACUUM main INTO ?", (path,))
+        snap = sqlite3.connect(path)
+        snap.execute("PRAGMA journal_mode = DELETE")
+        for (name,) in snap.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+            snap.execute(f"DROP TRIGGER {name}")
+        # Virtual tables first: dropping one drops its shadow tables too
+        for (name,) in snap.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                    "AND sql LIKE 'CREATE VIRTUAL TABLE%'").fetchall():
+            snap.execute(f"DROP TABLE {name}")
+        for (name,) in snap.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                    "AND name NOT LIKE 'sqlite_%'").fetchall():
+            if name not in database.BASE_TABLES:
+                snap.execute(f"DROP TABLE {name}")
+        for (name,) in snap.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall():
+            snap.execute(f"DROP INDEX {name}")
+        snap.commit()
+        snap.execute("VACUUM")
+        snap.close()
+        with open(path, 'rb') as f:
+            return f.read()
+
+def archive_snapshot(db_name=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'history.db')
+        src = sqlite3.connect(database.history_archive_path(db_name))
+        src.execute("VACUUM INTO ?", (path,))
+        src.close()
+        with open(path, 'rb') as f:
+            return f.read()
+
+def table_columns(conn, table):
+    """Stored columns (PRAGMA table_info leaves out generated ones)."""
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+def delta_lines(conn, through):
+    """JSON lines for every key in change_log up to seq `through`: current row, or null if deleted."""
+    lines = []
+    for table, key in database.BASE_TABLES.items():
+        keys = [r[0] for r in conn.execute(
+            "SELECT key FROM change_log WHERE tbl = ? AND seq <= ? GROUP BY key ORDER BY max(seq)", (table, through))]
+        if not keys:
+            continue
+        columns = table_columns(conn, table)
+        rows = {}
+        for r in conn.execute(f"""
+            SELECT {', '.join(columns)} FROM {table}
+            WHERE {key} IN (SELECT key FROM change_log WHERE tbl = ? AND seq <= ?)
+        """, (table, through)):
+            rows[r[columns.index(key)]] = dict(zip(columns, r))
+        for k in keys:
+            lines.append(json.dumps({'t': table, 'k': k, 'r': rows.get(k)}, ensure_ascii=False, separators=(',', ':')))
+    return lines
+
+def apply_delta(conn, payload):
+    """Replays one delta: upserts current rows, deletes removed ones. Returns the number of rows."""
+    columns = {}
+    count = 0
+    for line in payload.decode('utf-8').splitlines():
+        change = json.loads(line)
+        table, key = change['t'], database.BASE_TABLES[change['t']]
+        if change['r'] is None:
+            conn.execute(f"DELETE FROM {table} WHERE {key} = ?", (change['k'],))
+        else:
+            if table not in columns:
+                columns[table] = set(table_columns(conn, table))
+            row = {c: v for c, v in change['r'].items() if c in columns[table]}
+            names = list(row)
+            updates = ', '.join(f"{c} = excluded.{c}" for c in names if c != key)
+            conn.execute(f"""
+                INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})
+                ON CONFLICT ({key}) DO {'UPDATE SET ' + updates if updates else 'NOTHING'}
+            """, [row[c] for c in names])
+        count += 1
+    return count
+
+def remove_stale_files(manifest):
+    keep = {manifest['snapshot']['file']} | {e['file'] for e in manifest['deltas']}
+    if manifest.get('history'):
+        keep.add(manifest['history']['file'])
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.endswith('.gz') and name not in keep:
+            os.remove(os.path.join(SNAPSHOT_DIR, name))
+
+def export(db_name=None, force_snapshot=False):
+    """
+    Writes this run's changes (a delta, or a new snapshot when due) and clears the
+    change_log. The manifest is only rewritten when a file was written, so an idle run
+    commits nothing. Returns metrics: kind ('snapshot' / 'delta' / 'none'), rows, bytes_written.
+    """
+    started = time.perf_counter()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    manifest = load_manifest()
+    conn = database.connect(db_name)
+    through = conn.execute("SELECT coalesce(max(seq), 0) FROM change_log").fetchone()[0]
+    schema = schema_fingerprint(conn)
+    archived = archive_fingerprint(conn)
+
+    deltas = manifest['deltas'] if manifest else []
+    snapshot_due = (force_snapshot or manifest is None or manifest.get('schema') != schema
+                    or manifest.get('history_fingerprint') != archived or len(deltas) >= MAX_DELTAS
+                    or sum(e['bytes'] for e in deltas) >= SNAPSHOT_RATIO * manifest['snapshot']['bytes'])
+
+    result = {'kind': 'none', 'rows': 0, 'bytes_written': 0}
+    if snapshot_due:
+        entry = write_file('snapshot', 'db', base_snapshot(conn))
+        history = write_file('history', 'db', archive_snapshot(db_name)) if archived else None
+        result['kind'] = 'snapshot'
+        result['rows'] = sum(conn.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in database.BASE_TABLES)
+        result['bytes_written'] = entry['bytes'] + (history['bytes'] if history else 0)
+        manifest = {'version': FORMAT_VERSION, 'schema': schema, 'history_fingerprint': archived,
+                    'snapshot': {**entry, 'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')},
+                    'history': history, 'deltas': []}
+    else:
+        lines = delta_lines(conn, through)
+        if lines:
+            number = deltas[-1]['number'] + 1 if deltas else 1
+            entry = {**write_file(f"delta.{number:04d}", 'jsonl', ('\n'.join(lines) + '\n').encode('utf-8')),
+                     'number': number, 'rows': len(lines)}
+            manifest['deltas'] = deltas + [entry]
+            result.update(kind='delta', rows=len(lines), bytes_written=entry['bytes'])
+
+    with conn:
+        conn.execute("DELETE FROM change_log WHERE seq <= ?", (through,))
+    conn.close()
+
+    if result['kind'] != 'none':
+        manifest['last_export'] = {'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **result}
+        encoded = json.dumps(manifest, indent=1).encode('utf-8')
+        with open(MANIFEST_PATH, 'wb') as f:
+            f.write(encoded)
+        result['bytes_written'] += len(encoded)
+        remove_stale_files(manifest)
+    result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+def restore(db_name=None):
+    """
+    Rebuilds the DB file (and the history archive) from the snapshot and its deltas.
+    Only base tables are restored: run database.init_db afterwards (it calls this itself
+    on a fresh checkout) to recreate indexes and derived tables. Returns metrics, or None
+    when there is no snapshot.
+    """
+    manifest = load_manifest()
+    if manifest is None:
+        return None
+    started = time.perf_counter()
+    path = db_name or database.DB_NAME
+    partial = f"{path}.restoring"
+    with open(partial, 'wb') as f:
+        f.write(read_file(manifest['snapshot']))
+    if manifest.get('history'):
+        with open(database.history_archive_path(path), 'wb') as f:
+            f.write(read_file(manifest['history']))
+
+    conn = sqlite3.connect(partial)
+    rows = 0
+    with conn:
+        for entry in manifest['deltas']:
+            rows += apply_delta(conn, read_file(entry))
+    conn.close()
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(partial, path)
+
+    result = {'deltas': len(manifest['deltas']), 'rows': rows, 'elapsed_ms': (time.perf_counter() - started) * 1000}
+    print(f"Restored {path} from snapshot {manifest['snapshot']['created_at']} + {result['deltas']} deltas "
+          f"({rows} rows) in {result['elapsed_ms']:.0f} ms.")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database snapshot + delta pipeline (the DB itself is not in git).")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_export = sub.add_parser('export', help="Write this run's changes (or a new snapshot when due)")
+    p_export.add_argument('--snapshot', action='store_true', help="Write a full snapshot now")
+    p_restore = sub.add_parser('restore', help="Rebuild the DB from snapshot + deltas, then initialize it")
+    p_restore.add_argument('--force', action='store_true', help="Replace an existing DB file")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        result = export(force_snapshot=args.snapshot)
+        if result['kind'] == 'none':
+            print("No database changes since the last export. Nothing written.")
+        else:
+            print(f"Exported {result['kind']} ({result['rows']} rows): {result['bytes_written'] / 1024:.1f} KB "
+                  f"to push, in {result['elapsed_ms']:.0f} ms.")
+    else:
+        # Cold start = restore + init_db rebuilding indexes, FTS, R*Tree, stats, clusters and analytics
+        started = time.perf_counter()
+        restored = None
+        if args.force or not os.path.exists(database.DB_NAME):
+            restored = restore()
+        database.init_db()
+        if restored:
+            print(f"Cold start: {(time.perf_counter() - started) * 1000:.0f} ms "
+                  f"(restore {restored['elapsed_ms']:.0f} ms, rebuild of derived tables the rest).")
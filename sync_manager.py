@@ -1,138 +1,488 @@
 import requests
-import sqlite3
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone
+import argparse
 import json
-import io
+import os
 import sys
+import time
+import analytics
+import clusters
+import database
+import enrichment
+import history
+import http_cache
 import live_search
+import scrape_queue
 
 sys.stdout.reconfigure(encoding='utf-8')
 
-DB_NAME = "construction_intelligence.db"
 # If API fails, we use the specific CSV URL which is reliable
 CSV_URL = "https://data-cyc.opendata.arcgis.com/datasets/7044d1920639460da3fc4a3fa9273107_5.csv"
+# ArcGIS REST query endpoint of the same layer (.../FeatureServer/5/query) for incremental sync.
+# Unset -> always full CSV.
+FEATURE_SERVICE_URL = os.environ.get('YORK_FEATURE_SERVICE_URL', '')
+FEATURE_PAGE_SIZE = 1000
+# Rows per streamed CSV batch (parsed, normalized and upserted together); bounds peak memory
+CSV_BATCH_ROWS = 5000
+# Fixed dtypes so every batch parses numbers the same way (fingerprints must not depend on
+# whether a particular batch happened to contain a blank)
+CSV_DTYPES = {'OBJ': 'Int64', 'OBJECTID': 'Int64', 'LATITUDE': 'float64', 'LONGITUDE': 'float64',
+              'KEYVAL': 'str', 'REFVAL': 'str'}
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
 
-def sync_from_open_data():
-    print(f"[{datetime.now()}] Starting Sync from York Open Data...")
-    
-    # Check last sync time
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 1. Fetch Data (CSV for now as it's reliable)
-    # Ideally we use API "where objectid > max_id" but CSV is fast enough for 5MB
-    print("Downloading CSV via requests...")
-    
-    session = requests.Session()
-    retries = requests.adapters.HTTPAdapter(max_retries=3)
-    session.mount('https://', retries)
+# sync_state keys for the incremental checkpoint
+CHECKPOINT_OBJECTID = 'arcgis_max_objectid'
+CHECKPOINT_MODIFIED = 'arcgis_last_modified'
+# Validator (ETag / Last-Modified) of the last CSV that was fully ingested
+CSV_INGESTED_VERSION = 'csv_ingested_version'
+
+# Columns of `applications` populated from the open-data feed
+SOURCE_COLUMNS = [
+    'keyval', 'reference', 'proposal', 'status',
+    'received_date', 'validated_date', 'latitude', 'longitude', 'source_object_id'
+]
+# Staging table layout: source fields plus their fingerprint
+FEED_COLUMNS = SOURCE_COLUMNS + ['source_hash']
+
+def _first_column(df, names, default):
+    """Returns the first of `names` present in the CSV as a Series, else a constant Series."""
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series(default, index=df.index)
+
+def fingerprint_rows(records):
+    """
+    Content fingerprint (16 hex chars) of each record's source fields.
+    Hashes the stringified columns in one vectorized pass, so int/float/None
+    representations hash the same whichever feed they came from.
+    """
+    hashes = pd.util.hash_pandas_object(records[SOURCE_COLUMNS].astype(str), index=False)
+    return hashes.map('{:016x}'.format)
+
+def normalize_open_data(df):
+    """
+    Maps the raw open-data CSV columns onto our `applications` columns.
+    Vectorized equivalent of the old per-row loop; returns a DataFrame with
+    FEED_COLUMNS, one row per keyval (last occurrence wins), NaN -> None.
+    """
+    # Fields: DATEAPRECV, DCSTAT, KEYVAL, OBJ, PROPOSAL, LATITUDE, LONGITUDE, REFVAL
+    keyval = _first_column(df, ['KEYVAL'], None)
+    keyval = keyval.where(keyval.notna(), '').astype(str).str.strip()
+
+    out = pd.DataFrame({'keyval': keyval})
+    # Use REFVAL (Human Readable), falling back to keyval
+    ref = _first_column(df, ['REFVAL', 'REF', 'REFERENCE'], None)
+    out['reference'] = ref.where(ref.notna(), keyval)
+    out['proposal'] = _first_column(df, ['PROPOSAL'], '')
+    out['status'] = _first_column(df, ['DCSTAT'], 'Unknown')
+
+    # Dates: stored as canonical ISO (YYYY-MM-DD). The feed sends 'YYYY/MM/DD HH:MM:SS+00',
+    # which a vectorized slice handles; anything else goes through database.normalize_date
+    for col, src in (('received_date', 'DATEAPRECV'), ('validated_date', 'DATEAPVAL')):
+        raw = _first_column(df, [src], None)
+        iso = raw.astype(str).str[:10].str.replace('/', '-', regex=False)
+        ok = raw.notna() & iso.str.fullmatch(r'\d{4}-\d{2}-\d{2}')
+        out[col] = iso.where(ok, None)
+        odd = raw.notna() & ~ok
+        if odd.any():
+            out.loc[odd, col] = raw[odd].map(database.normalize_date)
+
+    out['latitude'] = _first_column(df, ['LATITUDE'], 0)
+    out['longitude'] = _first_column(df, ['LONGITUDE'], 0)
+    out['source_object_id'] = _first_column(df, ['OBJ'], 0)
+
+    out = out[out['keyval'] != '']
+    out = out.drop_duplicates(subset='keyval', keep='last')
+    # Plain Python objects so sqlite3 can bind them (numpy ints can't, NaN -> NULL)
+    out = out.astype(object).where(out.notna(), None)
+    out['source_hash'] = fingerprint_rows(out)
+    return out[FEED_COLUMNS].reset_index(drop=True)
+
+def stored_hashes(conn, keyvals, chunk=500):
+    """(keyval, source_hash, status) for the given keyvals only, so lookups scale with the batch, not the table."""
+    keyvals = list(keyvals)
+    rows = []
+    for i in range(0, len(keyvals), chunk):
+        part = keyvals[i:i + chunk]
+        rows += conn.execute(
+            f"SELECT keyval, source_hash, status FROM applications WHERE keyval IN ({','.join('?' * len(part))})", part
+        ).fetchall()
+    return rows
+
+def classify_changes(conn, records):
+    """
+    Compares record fingerprints against the stored ones (batch-scoped read + a vectorized merge).
+    A matching fingerprint only counts as unchanged while the stored status is still the
+    feed's: anything else that wrote status (live sync, a manual fix) is overwritten again.
+    Returns a Series aligned with `records`: 'new', 'changed' or 'unchanged'.
+    """
+    existing = pd.DataFrame(
+        [tuple(r) for r in stored_hashes(conn, records['keyval'])],
+        columns=['keyval', 'stored_hash', 'stored_status']
+    )
+    merged = records[['keyval', 'source_hash', 'status']].merge(existing, on='keyval', how='left', indicator=True)
+    same_status = (merged['stored_status'] == merged['status']) | (merged['stored_status'].isna() & merged['status'].isna())
+    kind = pd.Series('changed', index=records.index)
+    kind[(merged['_merge'] == 'left_only').to_numpy()] = 'new'
+    kind[((merged['stored_hash'] == merged['source_hash']) & same_status).to_numpy()] = 'unchanged'
+    return kind
+
+def bulk_upsert_applications(conn, records):
+    """
+    Set-based upsert of normalized feed records (see normalize_open_data).
+    Rows whose fingerprint matches the stored one are dropped up front; the rest
+    are loaded into a TEMP staging table with one executemany, then status history,
+    updates and inserts are applied as single statements in one transaction.
+    An unchanged feed performs no writes at all.
+    Returns counts: new, changed, unchanged, status_changes and elapsed_ms.
+    """
+    started = time.perf_counter()
+    now = datetime.now()
+    cols = ', '.join(FEED_COLUMNS)
+
+    kind = classify_changes(conn, records)
+    counts = kind.value_counts()
+    result = {
+        'new': int(counts.get('new', 0)),
+        'changed': int(counts.get('changed', 0)),
+        'unchanged': int(counts.get('unchanged', 0)),
+        'status_changes': 0
+    }
+    pending = records[(kind != 'unchanged').to_numpy()]
+    if pending.empty:
+        result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        return result
+
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS temp.staging_applications")
+        cursor.execute("""
+            CREATE TEMP TABLE staging_applications (
+                keyval TEXT PRIMARY KEY, reference TEXT, proposal TEXT, status TEXT,
+                received_date DATE, validated_date DATE, latitude REAL, longitude REAL,
+                source_object_id INTEGER, source_hash TEXT
+            )
+        """)
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO staging_applications ({cols}) VALUES ({', '.join(['?'] * len(FEED_COLUMNS))})",
+            pending.itertuples(index=False, name=None)
+        )
+
+        # Queue enrichment before applying changes (needs the pre-update state)
+        scrape_queue.enqueue_select(cursor, """
+            SELECT s.keyval FROM staging_applications s
+            WHERE NOT EXISTS (SELECT 1 FROM applications a WHERE a.keyval = s.keyval)
+        """, (), 'new', scrape_queue.PRIORITY_NEW)
+        scrape_queue.enqueue_select(cursor, """
+            SELECT s.keyval FROM staging_applications s JOIN applications a ON a.keyval = s.keyval
+            WHERE a.status IS NOT s.status
+        """, (), 'status_change', scrape_queue.PRIORITY_STATUS_CHANGE)
+
+        # AUDIT LOGGING (Phase 3): one row per status transition
+        result['status_changes'] = cursor.execute("""
+            INSERT INTO status_history (keyval, old_status, new_status, change_date)
+            SELECT a.keyval, a.status, s.status, ?
+            FROM applications a JOIN staging_applications s ON s.keyval = a.keyval
+            WHERE a.status IS NOT s.status
+        """, (now,)).rowcount
+
+        # Update changed rows with the feed's values
+        # A status change flips needs_scrape so the enricher picks up the decision
+        cursor.execute("""
+            UPDATE applications SET
+                reference = s.reference,
+                proposal = s.proposal,
+                status = s.status,
+                received_date = s.received_date,
+                validated_date = s.validated_date,
+                latitude = s.latitude,
+                longitude = s.longitude,
+                source_object_id = s.source_object_id,
+                source_hash = s.source_hash,
+                last_synced_api = ?,
+                needs_scrape = CASE WHEN applications.status IS NOT s.status
+                                    THEN 1 ELSE applications.needs_scrape END
+            FROM staging_applications s
+            WHERE applications.keyval = s.keyval
+        """, (now,))
+
+        # Insert New
+        cursor.execute(f"""
+            INSERT INTO applications ({cols}, last_synced_api, needs_scrape)
+            SELECT {cols}, ?, 1 FROM staging_applications s
+            WHERE NOT EXISTS (SELECT 1 FROM applications a WHERE a.keyval = s.keyval)
+        """, (now,))
+
+        cursor.execute("DROP TABLE temp.staging_applications")
+
+    result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+def apply_live_decisions(conn, decisions):
+    """
+    Applies live-search results (keyval, status, decision_date 'dd/mm/yyyy') set-based:
+    one executemany into a TEMP table, then the queueing, audit rows and update as
+    single statements in one transaction, however many decisions came in.
+    The portal shows labels ('Decided'), not the feed's codes, and a label doesn't say
+    which code it stands for: it goes into portal_status. Only a status that is a feed
+    code (history.CODE_RE) updates status and gets a status_history row.
+    Items without a usable decision date (weekly lists) keep the stored decision_date.
+    Returns counts: received, matched (known applications), changed, current
+    (already up to date), status_changes, undated and elapsed_ms.
+    """
+    started = time.perf_counter()
+    now = datetime.now()
+    rows = {}
+    for item in decisions:
+        if item.get('keyval'):
+            label = (item.get('status') or '').strip() or None
+            code = label if label and history.CODE_RE.match(label) else None
+            iso = database.normalize_date(item.get('decision_date'))
+            rows[item['keyval']] = (item['keyval'], code, label, iso)
+    result = {'received': len(decisions), 'matched': 0, 'changed': 0, 'current': 0,
+              'status_changes': 0, 'undated': sum(1 for r in rows.values() if r[3] is None)}
+
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS temp.live_decisions")
+        cursor.execute("""
+            CREATE TEMP TABLE live_decisions (keyval TEXT PRIMARY KEY, status TEXT, portal_status TEXT, decision_date DATE)
+        """)
+        cursor.executemany("""
+            INSERT OR REPLACE INTO live_decisions (keyval, status, portal_status, decision_date) VALUES (?, ?, ?, ?)
+        """, rows.values())
+
+        # status / decision_date only move when the portal gave a code / a date
+        moved = """(a.status IS NOT coalesce(l.status, a.status) OR a.portal_status IS NOT l.portal_status
+                    OR a.decision_date IS NOT coalesce(l.decision_date, a.decision_date))"""
+        result['matched'], result['changed'] = cursor.execute(f"""
+            SELECT count(*), coalesce(sum({moved}), 0)
+            FROM live_decisions l JOIN applications a ON a.keyval = l.keyval
+        """).fetchone()
+        result['current'] = result['matched'] - result['changed']
 
+        if result['changed']:
+            # A decision is new information for the enricher (agent, final decision date)
+            scrape_queue.enqueue_select(cursor, """
+                SELECT l.keyval FROM live_decisions l JOIN applications a ON a.keyval = l.keyval
+                WHERE a.status IS NOT coalesce(l.status, a.status) OR a.portal_status IS NOT l.portal_status
+            """, (), 'status_change', scrape_queue.PRIORITY_STATUS_CHANGE)
+
+            # AUDIT LOGGING: one row per status transition, as in the feed upsert (codes only)
+            result['status_changes'] = cursor.execute("""
+                INSERT INTO status_history (keyval, old_status, new_status, change_date)
+                SELECT a.keyval, a.status, l.status, ?
+                FROM applications a JOIN live_decisions l ON l.keyval = a.keyval
+                WHERE l.status IS NOT NULL AND a.status IS NOT l.status
+            """, (now,)).rowcount
+
+            cursor.execute(f"""
+                UPDATE applications SET
+                    status = coalesce(l.status, applications.status),
+                    portal_status = l.portal_status,
+                    decision_date = coalesce(l.decision_date, applications.decision_date)
+                FROM live_decisions l, applications a
+                WHERE applications.keyval = l.keyval AND a.keyval = l.keyval AND {moved}
+            """)
+
+        cursor.execute("DROP TABLE temp.live_decisions")
+
+    result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+def load_checkpoint(conn):
+    """Returns {'max_object_id', 'last_modified'} from sync_state, or None before the first full sync."""
+    max_id = database.get_sync_state(conn, CHECKPOINT_OBJECTID)
+    last_modified = database.get_sync_state(conn, CHECKPOINT_MODIFIED)
+    if max_id is None or last_modified is None:
+        return None
+    return {'max_object_id': int(max_id), 'last_modified': last_modified}
+
+def advance_checkpoint(df, checkpoint=None):
+    """The checkpoint moved up to the highest OBJECTID / DATE_MODIFIED seen in `df` (no writes)."""
+    new = dict(checkpoint or {'max_object_id': None, 'last_modified': None})
+    ids = pd.to_numeric(_first_column(df, ['OBJECTID', 'OBJ'], None), errors='coerce')
+    modified = pd.to_datetime(_first_column(df, ['DATE_MODIFIED'], None), errors='coerce', utc=True)
+
+    if ids.notna().any():
+        new['max_object_id'] = max(int(ids.max()), new['max_object_id'] or 0)
+    if modified.notna().any():
+        latest = modified.max().strftime('%Y-%m-%d %H:%M:%S')
+        new['last_modified'] = max(latest, new['last_modified'] or '')
+    return new
+
+def save_checkpoint(conn, new, checkpoint=None):
+    """
+    Stores `new` (see advance_checkpoint) if it differs from the loaded `checkpoint`.
+    Only writes when it actually moves, so a no-change run stays write-free.
+    """
+    checkpoint = checkpoint or {'max_object_id': None, 'last_modified': None}
+    if new == checkpoint or new['max_object_id'] is None or new['last_modified'] is None:
+        return checkpoint
+
+    with conn:
+        database.set_sync_state(conn, CHECKPOINT_OBJECTID, new['max_object_id'])
+        database.set_sync_state(conn, CHECKPOINT_MODIFIED, new['last_modified'])
+    return new
+
+def fetch_feature_changes(query_url, checkpoint, session=None, page_size=FEATURE_PAGE_SIZE):
+    """
+    Asks the ArcGIS REST query endpoint only for features added or modified since
+    the checkpoint (OBJECTID above the high-water mark, or DATE_MODIFIED newer),
+    paging with resultOffset. Returns a DataFrame shaped like the CSV (same
+    column names, date fields as 'YYYY/MM/DD HH:MM:SS+00' strings).
+    """
+    session = session or requests.Session()
+    where = (f"OBJECTID > {int(checkpoint['max_object_id'])} "
+             f"OR DATE_MODIFIED > TIMESTAMP '{checkpoint['last_modified']}'")
+    features = []
+    date_fields = set()
+    offset = 0
+
+    while True:
+        params = {
+            'where': where,
+            'outFields': '*',
+            'returnGeometry': 'false',
+            'orderByFields': 'OBJECTID ASC',
+            'resultOffset': offset,
+            'resultRecordCount': page_size,
+            'f': 'json'
+        }
+        response = session.get(query_url, params=params, headers=HEADERS, timeout=60)
+        response.raise_for_status()
+        page = response.json()
+        if 'error' in page:
+            raise RuntimeError(f"ArcGIS query error: {page['error']}")
+
+        date_fields.update(f['name'] for f in page.get('fields', []) if f.get('type') == 'esriFieldTypeDate')
+        batch = [f.get('attributes', {}) for f in page.get('features', [])]
+        features.extend(batch)
+        print(f"Fetched page at offset {offset}: {len(batch)} features")
+
+        if not batch or not (page.get('exceededTransferLimit') or len(batch) >= page_size):
+            break
+        offset += len(batch)
+
+    df = pd.DataFrame(features)
+    # f=json returns dates as epoch milliseconds; match the CSV's text format
+    for col in date_fields & set(df.columns):
+        stamps = pd.to_datetime(df[col], unit='ms', utc=True)
+        df[col] = stamps.dt.strftime('%Y/%m/%d %H:%M:%S+00').where(stamps.notna(), None)
+    return df
+
+def fetch_open_data_csv(session):
+    """
+    Conditional GET of the full open-data CSV through the HTTP cache. The body is
+    streamed to the cache file (read it back incrementally with response.open());
+    an unchanged feed is a single 304 and response.changed is False.
+    """
+    print("Downloading CSV via requests (conditional GET)...")
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = session.get(CSV_URL, headers=headers, timeout=60)
+        response = http_cache.get(session, CSV_URL, headers=HEADERS, timeout=60)
         response.raise_for_status()
-        csv_content = response.content.decode('utf-8')
-        df = pd.read_csv(io.StringIO(csv_content))
-        print(f"Downloaded {len(df)} records.")
+        return response
     except Exception as e:
         print(f"Download FAILED: {type(e).__name__}: {e}")
         # Re-raise to ensure workflow knows it failed
         raise e
 
-    # 2. Process & Upsert
-    # Fields: DATEAPRECV, DCSTAT, KEYVAL, OBJ, PROPOSAL, LATITUDE, LONGITUDE, REF, ADDRESS?
-    # Inspect columns
-    # print(df.columns)
+def iter_csv_batches(stream, batch_rows=CSV_BATCH_ROWS):
+    """Parses a binary CSV stream incrementally, yielding raw DataFrames of at most batch_rows rows."""
+    yield from pd.read_csv(stream, chunksize=batch_rows, encoding='utf-8-sig', dtype=CSV_DTYPES)
+
+def iter_frame_batches(df, batch_rows=CSV_BATCH_ROWS):
+    for start in range(0, len(df), batch_rows):
+        yield df.iloc[start:start + batch_rows]
+
+def ingest_batches(conn, batches, checkpoint=None):
+    """
+    Normalizes and upserts raw feed batches one at a time, so only one batch is
+    in memory however large the feed is. Each batch is its own transaction and is
+    idempotent; a keyval repeated in a later batch wins, as in a single pass.
+    The incremental checkpoint is saved once at the end, after every batch is in. A feed
+    without DATE_MODIFIED seeds the checkpoint's modified time from the sync start, so
+    the next run can still go incremental.
+    Returns the summed upsert counts plus rows and batches.
+    """
+    totals = {'rows': 0, 'batches': 0, 'new': 0, 'changed': 0, 'unchanged': 0,
+              'status_changes': 0, 'elapsed_ms': 0.0}
+    # Taken before reading: anything modified while this run is going is picked up next time
+    synced_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    seen = checkpoint
+    for batch in batches:
+        result = bulk_upsert_applications(conn, normalize_open_data(batch))
+        for key, value in result.items():
+            totals[key] += value
+        totals['rows'] += len(batch)
+        totals['batches'] += 1
+        seen = advance_checkpoint(batch, seen)
+    if seen is not None:
+        if seen['max_object_id'] is None:
+            print("Feed has no OBJECTID / OBJ column: incremental checkpoint not set, next run is a full CSV again.")
+        elif seen['last_modified'] is None:
+            print(f"Feed has no usable DATE_MODIFIED: checkpoint modified time seeded from this sync ({synced_at} UTC).")
+            seen['last_modified'] = synced_at
+        save_checkpoint(conn, seen, checkpoint)
+    return totals
+
+def sync_from_open_data(mode='auto', feature_url=None,
+                        workers=enrichment.DEFAULT_WORKERS, rate=enrichment.DEFAULT_RATE):
+    """
+    mode: 'auto' (incremental when a checkpoint exists, else full CSV),
+          'full' (always the CSV, re-parsed even if unchanged) or
+          'incremental' (same as auto, but says so when it falls back).
+    workers / rate: enrichment pool size and its shared requests-per-second budget.
+    """
+    print(f"[{datetime.now()}] Starting Sync from York Open Data...")
+    feature_url = feature_url or FEATURE_SERVICE_URL
     
-    # Normalize
-    records_added = 0
-    records_updated = 0
+    conn = database.get_db_connection()
     
-    for index, row in df.iterrows():
-        keyval = str(row.get('KEYVAL', '')).strip()
-        if not keyval: continue
-        
-        # Prepare data
-        ref = row.get('REFVAL', row.get('REF', row.get('REFERENCE', keyval))) # Use REFVAL (Human Readable)
-        # Note: CSV might not have ADDRESS column explicitly?
-        # Based on previous context, we scraped it. But check if CSV has it.
-        # User CSV had 'OBJ' (Object ID).
-        
-        # We need to map CSV columns to DB columns
-        status = row.get('DCSTAT', 'Unknown')
-        proposal = row.get('PROPOSAL', '')
-        lat = row.get('LATITUDE', 0)
-        lon = row.get('LONGITUDE', 0)
-        obj_id = row.get('OBJ', 0)
-        
-        # Date parsing
-        date_recv = None
-        date_valid = None
-        
-        # Validated Date
-        try:
-            d_val = row.get('DATEAPVAL')
-            if pd.notna(d_val):
-                date_valid = str(d_val)[:10] # ISO often: YYYY-MM-DD...
-        except: pass
+    session = requests.Session()
+    retries = requests.adapters.HTTPAdapter(max_retries=3)
+    session.mount('https://', retries)
 
-        # Received Date
-        raw_date = str(row.get('DATEAPRECV', ''))
+    # 1. Fetch Data + 2. Process & Upsert
+    # Incremental delta from the feature service when we have a checkpoint,
+    # otherwise (first run / no endpoint / query failure) the full CSV, streamed.
+    # Either way records are normalized and upserted in fixed-size batches
+    # (vectorized normalize + staging-table upsert, one transaction per batch)
+    df = None
+    checkpoint = load_checkpoint(conn)
+    if mode != 'full' and feature_url and checkpoint:
+        print(f"Incremental sync since OBJECTID {checkpoint['max_object_id']} / {checkpoint['last_modified']}...")
         try:
-             if isinstance(row.get('DATEAPRECV'), (pd.Timestamp, datetime)):
-                 date_recv = row.get('DATEAPRECV').date()
-             else:
-                 date_recv = str(raw_date)[:10]
-        except: pass
-
-        # Check existing
-        cursor.execute("SELECT status, needs_scrape FROM applications WHERE keyval = ?", (keyval,))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Calculate scrape flag
-            new_scrape_val = existing['needs_scrape']
-            if existing['status'] != status:
-                new_scrape_val = 1
-                # AUDIT LOGGING (Phase 3)
-                try:
-                    cursor.execute("INSERT INTO status_history (keyval, old_status, new_status, change_date) VALUES (?, ?, ?, ?)", 
-                                  (keyval, existing['status'], status, datetime.now()))
-                    # print(f"Logged status change for {keyval}: {existing['status']} -> {status}")
-                except Exception as e:
-                    print(f"Audit log failed: {e}")
-            
-            # Update (Always update Reference to fix missing values from previous bug)
-            cursor.execute("""
-                UPDATE applications SET 
-                status = ?, 
-                reference = ?,
-                validated_date = ?,
-                last_synced_api = ?,
-                needs_scrape = ?
-                WHERE keyval = ?
-             """, (status, ref, date_valid, datetime.now(), new_scrape_val, keyval))
-            records_updated += 1
+            df = fetch_feature_changes(feature_url, checkpoint, session=session)
+            print(f"Fetched {len(df)} new/modified records.")
+        except Exception as e:
+            print(f"Incremental fetch FAILED ({type(e).__name__}: {e}). Falling back to full CSV.")
+    elif mode == 'incremental':
+        print("No checkpoint or feature service URL yet. Falling back to full CSV.")
+
+    if df is not None:
+        result = ingest_batches(conn, iter_frame_batches(df), checkpoint)
+    else:
+        response = fetch_open_data_csv(session)
+        if (mode != 'full' and response.version
+                and response.version == database.get_sync_state(conn, CSV_INGESTED_VERSION)):
+            result = None # 304 for the CSV we already ingested: nothing to parse
         else:
-            # Insert New
-            cursor.execute("""
-                INSERT INTO applications (
-                    keyval, reference, proposal, status, 
-                    received_date, validated_date, latitude, longitude, 
-                    source_object_id, last_synced_api, needs_scrape
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-            """, (keyval, ref, proposal, status, date_recv, date_valid, lat, lon, obj_id, datetime.now()))
-            records_added += 1
-            
-    conn.commit()
+            with response.open() as f:
+                result = ingest_batches(conn, iter_csv_batches(f), checkpoint)
+            if response.version:
+                with conn:
+                    database.set_sync_state(conn, CSV_INGESTED_VERSION, response.version)
     conn.close()
-    print(f"Sync Complete. Added: {records_added}, Updated: {records_updated}")
+    if result is None:
+        print("Sync Complete. Open-data CSV unchanged since the last sync, skipped parsing.")
+    else:
+        print(f"Sync Complete. Rows: {result['rows']} in {result['batches']} batches. New: {result['new']}, "
+              f"Changed: {result['changed']}, Unchanged: {result['unchanged']}, "
+              f"Status changes: {result['status_changes']} ({result['elapsed_ms']:.0f} ms in the DB)")
 
     # 3. Live Sync (Recent Decisions)
     try:
@@ -141,128 +491,59 @@ def sync_from_open_data():
         if not recent:
             print("No recent decisions found.")
         else:
-            conn = get_db_connection()
-            l_cursor = conn.cursor()
-            l_updates = 0
-            
-            for item in recent:
-                kv = item['keyval']
-                st = item['status']
-                dd_str = item['decision_date'] # e.g. 10/02/2026
-                
-                # Convert Date Format -> YYYY-MM-DD
-                dd_db = None
-                try:
-                    dt = datetime.strptime(dd_str, '%d/%m/%Y')
-                    dd_db = dt.strftime('%Y-%m-%d')
-                except:
-                    # Try other formats?
-                    pass
-                
-                if dd_db:
-                    l_cursor.execute("UPDATE applications SET status = ?, decision_date = ? WHERE keyval = ?", (st, dd_db, kv))
-                    if l_cursor.rowcount > 0:
-                        l_updates += 1
-                        
-            conn.commit()
+            conn = database.get_db_connection()
+            live = apply_live_decisions(conn, recent)
             conn.close()
-            print(f"Live Sync Updated {l_updates} records with decision dates.")
-            
+            print(f"Live Sync: {live['received']} decisions, {live['changed']} records updated, "
+                  f"{live['current']} already current, {live['received'] - live['matched']} unknown, "
+                  f"{live['undated']} without a date. Status changes: {live['status_changes']} "
+                  f"({live['elapsed_ms']:.0f} ms)")
     except Exception as e:
         print(f"Live sync error: {e}")
 
-    # 4. Targeted Backfill for Missing Decision Dates
-    # 4. robust Scraping (Address, Agent, Decision Date)
-    # Target applications that need scraping (new or updated status)
-    conn = get_db_connection()
-    c = conn.cursor()
+    # 4. Robust Scraping (Address, Agent, Decision Date)
+    # Work comes from the persistent scrape queue: new records and status changes
+    # are queued by the upsert above, data gaps / stale records are topped up here.
+    # Failures back off exponentially and are dead-lettered after a few attempts.
+    conn = database.get_db_connection()
+    queued = scrape_queue.refresh(conn)
+    print(f"Scrape queue: {scrape_queue.summary(conn)} (added {queued})")
     
-    # Priority: Newest applications first (received_date DESC)
-    # Limit to 50 per run to avoid timeout/blocking (run every 6 hours = 200/day)
-    rows = c.execute("""
-        SELECT keyval, reference, status FROM applications 
-        WHERE needs_scrape = 1 
-        ORDER BY received_date DESC 
-        LIMIT 500
-    """).fetchall()
+    # Limit per run to avoid timeout/blocking (run every 6 hours)
+    rows = scrape_queue.next_batch(conn, limit=500)
     
     if rows:
-        print(f"Found {len(rows)} applications needing details. Scraping (max 50)...")
-        import scraper
-        import time
-        count = 0
-        
-        for r in rows:
-            kv = r['keyval']
-            # ref = r['reference'] 
-            print(f"Scraping details for {kv}...")
-            
-            try:
-                # Scrape
-                details = scraper.scrape_application_details(kv)
-                
-                if details['success']:
-                     # Prepare Updates
-                     updates = []
-                     start_params = []
-                     
-                     # Address
-                     if details['address']:
-                         updates.append("address = ?")
-                         start_params.append(details['address'])
-                         
-                     # Agent
-                     if details['agent']:
-                         updates.append("agent_name = ?")
-                         start_params.append(details['agent'])
-                         
-                     # Decision Date
-                     # Convert dd/mm/yy -> YYYY-MM-DD
-                     db_date = None
-                     if details['decision_date']:
-                         try:
-                             dt = datetime.strptime(details['decision_date'], '%d/%m/%y')
-                             db_date = dt.strftime('%Y-%m-%d')
-                             updates.append("decision_date = ?")
-                             start_params.append(db_date)
-                         except: pass
-
-                     # Portal Keyval (Self-healing)
-                     if details['portal_keyval']:
-                         updates.append("portal_keyval = ?")
-                         start_params.append(details['portal_keyval'])
-
-                     # Always update meta
-                     updates.append("last_scraped_details = ?")
-                     start_params.append(datetime.now())
-                     
-                     updates.append("needs_scrape = 0")
-                     
-                     # Validation Warning (Phase 3 Idea - optional)
-                     # if details['scraped_status'] != ...
-                     
-                     sql = f"UPDATE applications SET {', '.join(updates)} WHERE keyval = ?"
-                     start_params.append(kv)
-                     
-                     c.execute(sql, start_params)
-                     count += 1
-                     print(f"Updated {kv}: Addr={bool(details['address'])}, Agent={bool(details['agent'])}")
-                     
-                else:
-                    print(f"Scrape failed for {kv}: {details.get('error')}")
-                    # Maybe increment a retry counter? For now, leave needs_scrape=1 to retry next time
-                    # Or set to 0 if we want to give up? Let's leave it 1 but maybe add 'failed_attempts' column later.
-                    
-            except Exception as e:
-                print(f"Scrape loop error {kv}: {e}")
-                
-            # Polite Delay
-            time.sleep(1)
-                
-        conn.commit()
-        print(f"Scraped and updated {count} applications.")
-    
+        print(f"Found {len(rows)} applications needing details. Scraping with {workers} workers @ {rate:g} req/s...")
+        # Workers scrape concurrently under one shared request budget; this thread writes in batches
+        enrichment.enrich_applications(conn, rows, workers=workers, rate=rate)
+
+    # History housekeeping: old rows move to the archive DB, redundant transitions are collapsed
+    with conn:
+        archived = history.archive(conn)
+    with conn:
+        compacted = history.compact(conn)
+    print(f"History: {compacted['deleted']} redundant rows dropped, {compacted['merged']} merged, {archived} archived.")
+
+    # Agent statistics, map clusters and decision-time analytics, for just the agents / cells /
+    # applications this run touched (marked dirty by triggers)
+    with conn:
+        refreshed = database.refresh_agent_stats(conn)
+        cells = clusters.refresh(conn)
+        decisions = analytics.refresh(conn)
+    print(f"Agent stats refreshed for {refreshed} agents, map clusters for {cells} cells, "
+          f"decision-time analytics for {decisions} applications.")
     conn.close()
 
+    # 5. HTTP cache housekeeping
+    evicted = http_cache.prune()
+    print(f"{http_cache.summary()} ({evicted} evicted)")
+
 if __name__ == "__main__":
-    sync_from_open_data()
+    parser = argparse.ArgumentParser(description="Sync York planning applications into the local DB.")
+    parser.add_argument('--mode', choices=['auto', 'full', 'incremental'], default='auto')
+    parser.add_argument('--workers', type=int, default=enrichment.DEFAULT_WORKERS,
+                        help="Concurrent scrape workers")
+    parser.add_argument('--rate', type=float, default=enrichment.DEFAULT_RATE,
+                        help="Portal requests per second across all workers")
+    args = parser.parse_args()
+    sync_from_open_data(mode=args.mode, workers=args.workers, rate=args.rate)